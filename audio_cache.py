@@ -0,0 +1,108 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from storage import write_atomic
+
+
+class AudioCache:
+    """Content-addressed on-disk cache of synthesized int16 PCM.
+
+    Each entry is one raw `.pcm` file named after the hash of everything that
+    determines the audio. Reads are memory-mapped, so a hit costs no copy until
+    the bytes are sent. The total size is bounded by `max_bytes`; the least
+    recently used entries (by file mtime, which hits refresh) are evicted first.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):
+                # Left behind by a crash mid-write
+                os.remove(os.path.join(directory, name))
+            elif name.endswith(".pcm"):
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def key(*parts):
+        """Hash the parts (anything JSON serializable) into a cache key"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pcm")
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """Return the cached PCM as a read-only int16 memmap, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        path = self._path(key)
+        try:
+            os.utime(path)
+            return np.memmap(path, dtype=np.int16, mode="r")
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+            return None
+
+    def put(self, key, pcm):
+        """Store int16 PCM under `key` (written to a temp file, then renamed into place).
+
+        The audio has already been served when it is cached, so a failed write
+        (e.g. a full disk) is logged and the entry skipped.
+        """
+        data = np.ascontiguousarray(pcm, dtype=np.int16).reshape(-1)
+        if data.nbytes == 0 or data.nbytes > self.max_bytes:
+            return
+        try:
+            write_atomic(self._path(key), lambda f: f.write(data.data))
+        except OSError as e:
+            print(f"Could not write {self.directory} cache entry: {e!r}", flush=True)
+            return
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = data.nbytes
+            self._bytes += data.nbytes
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
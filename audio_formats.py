@@ -0,0 +1,267 @@
+import asyncio
+import math
+import shutil
+import struct
+
+import numpy as np
+
+FFMPEG = shutil.which("ffmpeg")
+
+# ffmpeg output options and media type per compressed output format. Opus is
+# tuned for latency (20 ms frames, one Ogg page per frame); MP3 and FLAC are
+# meant for archiving.
+FORMATS = {
+    "opus": (
+        ["-c:a", "libopus", "-b:a", "32k", "-application", "lowdelay", "-frame_duration", "20", "-page_duration", "20000", "-f", "ogg"],
+        "audio/ogg",
+    ),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"], "audio/mpeg"),
+    "flac": (["-c:a", "flac", "-f", "flac"], "audio/flac"),
+}
+
+READ_SIZE = 4096
+
+
+def media_type(output_format):
+    return FORMATS[output_format][1]
+
+
+async def encode(chunks, output_format, sample_rate=24000):
+    """Encode an async iterable of int16 PCM chunks, yielding encoded bytes as they come out.
+
+    Encoding runs in an ffmpeg subprocess fed through a pipe, so it never
+    competes with the inference thread and output starts with the first chunk.
+    """
+    options, _ = FORMATS[output_format]
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG,
+        "-hide_banner",
+        "-loglevel", "error",
+        "-f", "s16le",
+        "-ar", str(sample_rate),
+        "-ac", "1",
+        "-i", "pipe:0",
+        *options,
+        "-flush_packets", "1",
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                proc.stdin.write(memoryview(chunk).cast("B"))
+                await proc.stdin.drain()
+        finally:
+            proc.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            data = await proc.stdout.read(READ_SIZE)
+            if not data:
+                break
+            yield data
+        # Re-raise synthesis errors from the feeder
+        await feeder
+        if await proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {output_format} (exit code {proc.returncode})")
+    finally:
+        feeder.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+RESAMPLE_BLOCK = 4096
+
+
+class PolyphaseResampler:
+    """Streaming rational resampler (windowed-sinc FIR, polyphase form).
+
+    Keeps the last input samples the filter needs between calls, so feeding a
+    signal in chunks gives the same output as resampling it in one go. The
+    filter's group delay is compensated: the first `delay` output samples are
+    dropped and `flush` returns the tail they held back, so the output lines
+    up with the input and has its length.
+    """
+
+    def __init__(self, rate_in, rate_out, zero_crossings=32, beta=6.0):
+        g = math.gcd(rate_in, rate_out)
+        self.up = rate_out // g
+        self.down = rate_in // g
+        factor = max(self.up, self.down)
+        n_taps = 2 * zero_crossings * factor + 1
+        cutoff = 0.9 / factor
+        t = np.arange(n_taps) - (n_taps - 1) / 2
+        h = cutoff * np.sinc(cutoff * t) * np.kaiser(n_taps, beta) * self.up
+        self.taps = -(-n_taps // self.up)
+        h = np.pad(h, (0, self.taps * self.up - n_taps))
+        # phases[p, k] = h[p + k * up]
+        self.phases = h.reshape(self.taps, self.up).T.astype(np.float32)
+        self.delay = (n_taps - 1) / 2 / self.down
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.start = -(self.taps - 1)
+        self.n_out = 0
+        # Output samples still to drop (the delay); input taken and output returned so far
+        self.skip = int(round(self.delay))
+        self.n_in = 0
+        self.returned = 0
+
+    def process(self, x):
+        """Resample the next chunk of float32 samples"""
+        x = np.asarray(x, dtype=np.float32)
+        self.n_in += len(x)
+        y = self._filter(x)
+        self.returned += len(y)
+        return y
+
+    def _filter(self, x):
+        buf = np.concatenate([self.history, x])
+        end = self.start + len(buf)
+        last = (end * self.up - 1) // self.down
+        positions = np.arange(self.n_out, max(last + 1, self.n_out)) * self.down
+        y = np.empty(len(positions), dtype=np.float32)
+        # Output is computed in blocks to bound the size of the gathered input windows
+        for i in range(0, len(positions), RESAMPLE_BLOCK):
+            pos = positions[i : i + RESAMPLE_BLOCK]
+            idx = (pos // self.up - self.start)[:, None] - np.arange(self.taps)[None, :]
+            y[i : i + RESAMPLE_BLOCK] = np.einsum("nk,nk->n", buf[idx], self.phases[pos % self.up])
+        self.n_out += len(positions)
+        self.history = buf[len(buf) - (self.taps - 1) :]
+        self.start = end - (self.taps - 1)
+        if self.skip:
+            dropped = min(self.skip, len(y))
+            self.skip -= dropped
+            y = y[dropped:]
+        return y
+
+    def flush(self):
+        """Drain the filter delay at the end of the stream"""
+        # Output samples of the whole input, less those already returned
+        left = -(-self.n_in * self.up // self.down) - self.returned
+        # Enough zeros to push every held-back sample out of the filter
+        zeros = np.zeros(self.taps + int(math.ceil(self.delay * self.down / self.up)), dtype=np.float32)
+        y = self._filter(zeros)[: max(0, left)]
+        self.returned += len(y)
+        return y
+
+
+def lin2ulaw(pcm):
+    """G.711 mu-law encode int16 samples (vectorized version of the classic g711.c)"""
+    x = pcm.astype(np.int32)
+    sign = np.where(x < 0, 0x80, 0)
+    mag = np.minimum(np.abs(x), 32635) + 0x84
+    exponent = np.frexp(mag)[1] - 8
+    mantissa = (mag >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+ALAW_SEG_END = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+
+def lin2alaw(pcm):
+    """G.711 A-law encode int16 samples (vectorized version of the classic g711.c)"""
+    x = pcm.astype(np.int32) >> 3
+    negative = x < 0
+    mask = np.where(negative, 0x55, 0xD5)
+    x = np.where(negative, -x - 1, x)
+    seg = np.searchsorted(ALAW_SEG_END, x)
+    aval = (seg << 4) | ((x >> np.where(seg < 2, 1, seg)) & 0x0F)
+    return (np.where(seg >= 8, 0x7F, aval) ^ mask).astype(np.uint8)
+
+
+# Output profile: (sample rate, sample encoding)
+PROFILES = {
+    "pcm16_24k": (24000, "pcm16"),
+    "pcm16_16k": (16000, "pcm16"),
+    "mulaw_8k": (8000, "mulaw"),
+    "alaw_8k": (8000, "alaw"),
+}
+
+FRAME_SECONDS = 0.02
+PROFILE_MEDIA_TYPES = {"pcm16": "application/octet-stream", "mulaw": "audio/PCMU", "alaw": "audio/PCMA"}
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+
+
+class OutputProfile:
+    """Convert the model's 24 kHz int16 stream to a profile, in whole 20 ms frames.
+
+    One instance per stream: it carries the resampler state and the samples
+    of an incomplete frame over to the next chunk. The last frame is padded
+    with silence by `flush`.
+    """
+
+    def __init__(self, name, input_rate=24000):
+        self.name = name
+        self.sample_rate, self.encoding = PROFILES[name]
+        self.resampler = PolyphaseResampler(input_rate, self.sample_rate) if self.sample_rate != input_rate else None
+        self.frame = int(self.sample_rate * FRAME_SECONDS)
+        self.pending = np.zeros(0, dtype=np.int16)
+
+    @property
+    def sample_width(self):
+        return 2 if self.encoding == "pcm16" else 1
+
+    @property
+    def media_type(self):
+        """Media type of the raw (headerless) profile audio"""
+        return PROFILE_MEDIA_TYPES[self.encoding]
+
+    def _encode(self, samples):
+        if self.encoding == "mulaw":
+            return lin2ulaw(samples).tobytes()
+        if self.encoding == "alaw":
+            return lin2alaw(samples).tobytes()
+        return samples.tobytes()
+
+    def _to_int16(self, y):
+        return np.clip(np.rint(y * 32768), -32768, 32767).astype(np.int16)
+
+    def process(self, pcm):
+        """Convert the next int16 chunk, returning the bytes of the frames it completes"""
+        if self.resampler is not None:
+            pcm = self._to_int16(self.resampler.process(pcm.reshape(-1).astype(np.float32) / 32768))
+        samples = np.concatenate([self.pending, pcm.reshape(-1)])
+        whole = len(samples) - len(samples) % self.frame
+        self.pending = samples[whole:]
+        return self._encode(samples[:whole])
+
+    def flush(self):
+        """Bytes of the last frame(s), padded with silence to a whole frame"""
+        samples = self.pending
+        if self.resampler is not None:
+            samples = np.concatenate([samples, self._to_int16(self.resampler.flush())])
+        self.pending = np.zeros(0, dtype=np.int16)
+        if len(samples) % self.frame:
+            samples = np.pad(samples, (0, self.frame - len(samples) % self.frame))
+        return self._encode(samples)
+
+    def wav_header(self, data_length=0):
+        """WAV header for this profile (G.711 profiles use the mu-law/A-law format tags)"""
+        if self.encoding == "pcm16":
+            format_tag, fmt_extra = 1, b""
+        else:
+            format_tag = WAVE_FORMAT_MULAW if self.encoding == "mulaw" else WAVE_FORMAT_ALAW
+            fmt_extra = struct.pack("<H", 0)
+        fmt = struct.pack(
+            "<HHIIHH",
+            format_tag,
+            1,
+            self.sample_rate,
+            self.sample_rate * self.sample_width,
+            self.sample_width,
+            8 * self.sample_width,
+        ) + fmt_extra
+        return (
+            b"RIFF"
+            + struct.pack("<I", 4 + 8 + len(fmt) + 8 + data_length)
+            + b"WAVE"
+            + b"fmt "
+            + struct.pack("<I", len(fmt))
+            + fmt
+            + b"data"
+            + struct.pack("<I", data_length)
+        )
@@ -0,0 +1,196 @@
+import functools
+import math
+import time
+import zlib
+
+import torch
+
+from TTS.tts.layers.xtts.tokenizer import split_sentence
+
+from batching import MicroBatchScheduler, default_kwargs, split_text
+from speakers import batch_conditioning_latents, conditioning_latents
+
+# XTTS v2 languages, for backends without a model config
+LANGUAGES = ["en", "es", "fr", "de", "it", "pt", "pl", "tr", "ru", "nl", "cs", "ar", "zh-cn", "hu", "ko", "ja", "hi"]
+MAX_TEXT_TOKENS = 400
+# Characters per sentence XTTS's tokenizer allows, per language (its char_limits)
+CHAR_LIMITS = {
+    "en": 250,
+    "de": 253,
+    "fr": 273,
+    "es": 239,
+    "it": 213,
+    "pt": 203,
+    "pl": 224,
+    "zh": 82,
+    "ar": 166,
+    "cs": 186,
+    "ru": 182,
+    "nl": 251,
+    "tr": 226,
+    "ja": 71,
+    "hu": 224,
+    "ko": 95,
+    "hi": 150,
+}
+
+
+class XttsBackend:
+    """What the endpoints need from the model: text handling, conditioning and a batch scheduler.
+
+    Synthesis itself goes through the scheduler the backend makes, which the
+    executor runs on its inference thread(s).
+    """
+
+    name = "xtts"
+
+    def __init__(self, model, config):
+        self.model = model
+        self.languages = config.languages
+        self.char_limits = model.tokenizer.char_limits
+        self.clone_kwargs = default_kwargs(model.get_conditioning_latents)
+
+    def split(self, text, language):
+        """Split `text` into sentences like `inference_stream(enable_text_splitting=True)`"""
+        return split_text(self.model, text, language)
+
+    def tokenize(self, sentence, language):
+        """Text tokens of one sentence, shaped [1, tokens]"""
+        tokens = torch.IntTensor(self.model.tokenizer.encode(sentence, lang=language)).unsqueeze(0)
+        assert tokens.shape[-1] < self.model.args.gpt_max_text_tokens, " ❗ XTTS can only generate text with a maximum of 400 tokens."
+        return tokens
+
+    def make_scheduler(self, **kwargs):
+        return MicroBatchScheduler(self.model, **kwargs)
+
+    def studio_speakers(self):
+        """Name -> (gpt_cond_latent, speaker_embedding) of the speakers shipped with the model"""
+        if not (hasattr(self.model, "speaker_manager") and hasattr(self.model.speaker_manager, "speakers")):
+            return {}
+        return {
+            name: (latents["gpt_cond_latent"], latents["speaker_embedding"])
+            for name, latents in self.model.speaker_manager.speakers.items()
+        }
+
+    def conditioning_latents(self, audio):
+        with torch.inference_mode():
+            return conditioning_latents(
+                self.model,
+                audio,
+                self.clone_kwargs["load_sr"],
+                self.clone_kwargs["gpt_cond_len"],
+                self.clone_kwargs["gpt_cond_chunk_len"],
+                sound_norm_refs=self.clone_kwargs["sound_norm_refs"],
+            )
+
+    def batch_conditioning_latents(self, audios):
+        with torch.inference_mode():
+            return batch_conditioning_latents(
+                self.model,
+                audios,
+                self.clone_kwargs["load_sr"],
+                self.clone_kwargs["gpt_cond_len"],
+                self.clone_kwargs["gpt_cond_chunk_len"],
+                sound_norm_refs=self.clone_kwargs["sound_norm_refs"],
+            )
+
+
+# Rough XTTS rates: audio tokens per text token, and 24 kHz samples per audio token
+AUDIO_TOKENS_PER_TEXT_TOKEN = 1.6
+SAMPLES_PER_TOKEN = 1024
+SAMPLE_RATE = 24000
+MAX_AUDIO_TOKENS = 605
+
+
+def synthetic_wav(tokens, first, last):
+    """Audio tokens `first` to `last` of a sentence as a sine tone picked by its text"""
+    frequency = 110 + zlib.crc32(tokens.numpy().tobytes()) % 330
+    t = torch.arange(first * SAMPLES_PER_TOKEN, last * SAMPLES_PER_TOKEN, dtype=torch.float32) / SAMPLE_RATE
+    return 0.3 * torch.sin(2 * math.pi * frequency * t)
+
+
+def seeded_latents(seed):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn((1, 32, 1024), generator=generator), torch.randn((1, 512, 1), generator=generator)
+
+
+class StubScheduler(MicroBatchScheduler):
+    """Batches like the real scheduler, but decodes by sleeping `token_ms` per step for the whole batch.
+
+    A sentence decodes to about as many audio tokens as XTTS would produce,
+    streaming requests get a chunk every `stream_chunk_size` tokens, and the
+    audio is a deterministic tone, so everything around the model (queueing,
+    batching, PCM conversion, encoding, framing) runs as in production.
+    """
+
+    def __init__(self, token_ms=10, **kwargs):
+        super().__init__(None, **kwargs)
+        self.token_seconds = token_ms / 1000
+
+    def _generation_defaults(self):
+        return {}, {}
+
+    def _run_batch(self, batch):
+        self._decode(batch, stream=False)
+
+    def _run_stream_batch(self, batch):
+        self._decode(batch, stream=True)
+
+    def _decode(self, batch, stream):
+        start = time.perf_counter()
+        segments = [request.segments.pop() for request in batch]
+        lengths = [
+            min(MAX_AUDIO_TOKENS, max(1, round(tokens.shape[-1] * AUDIO_TOKENS_PER_TEXT_TOKEN))) for tokens in segments
+        ]
+        emitted = [0] * len(batch)
+        for step in range(1, max(lengths) + 1):
+            time.sleep(self.token_seconds)
+            for i, request in enumerate(batch):
+                if step > lengths[i]:
+                    continue
+                chunk = request.stream_chunk_size if stream and request.stream_chunk_size > 0 else lengths[i]
+                if step == lengths[i] or step - emitted[i] >= chunk:
+                    self.vocoder.vocode(request, functools.partial(synthetic_wav, segments[i], emitted[i], step))
+                    emitted[i] = step
+        elapsed = time.perf_counter() - start
+        for request in batch:
+            request.timings["gpt"] += elapsed
+
+
+class StubBackend:
+    """Deterministic stand-in for XTTS that needs no weights (BACKEND=stub).
+
+    Text is split like XTTS does, with its per-language sentence limits, and
+    tokenized one token per character;
+    cloning returns latents seeded by the audio content, and there is one
+    studio speaker, "Stub Speaker".
+    """
+
+    name = "stub"
+
+    def __init__(self, token_ms=10):
+        self.token_ms = token_ms
+        self.languages = LANGUAGES
+        self.char_limits = dict(CHAR_LIMITS)
+        self.clone_kwargs = {"load_sr": 22050, "max_ref_length": 30}
+
+    def split(self, text, language):
+        language = language.split("-")[0]
+        return split_sentence(text, language, self.char_limits.get(language, 250))
+
+    def tokenize(self, sentence, language):
+        tokens = torch.IntTensor([ord(char) for char in sentence]).unsqueeze(0)
+        assert tokens.shape[-1] < MAX_TEXT_TOKENS, " ❗ XTTS can only generate text with a maximum of 400 tokens."
+        return tokens
+
+    def make_scheduler(self, **kwargs):
+        return StubScheduler(token_ms=self.token_ms, **kwargs)
+
+    def studio_speakers(self):
+        return {"Stub Speaker": seeded_latents(0)}
+
+    def conditioning_latents(self, audio):
+        return seeded_latents(zlib.crc32(audio.numpy().tobytes()))
+
+    def batch_conditioning_latents(self, audios):
+        return [self.conditioning_latents(audio) for audio in audios]
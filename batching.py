@@ -0,0 +1,441 @@
+import asyncio
+import collections
+import copy
+import functools
+import inspect
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+from TTS.tts.layers.xtts.tokenizer import split_sentence
+
+from pipeline import VocoderStage
+from profiling import trace_round
+
+# Request priorities (lower runs first): streams, whole-utterance /tts, queued jobs
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_BACKGROUND = 2
+
+
+class DeadlineExceeded(RuntimeError):
+    """The request's deadline passed before it was done, so the rest of it was dropped"""
+
+
+def default_kwargs(fn):
+    """Return the keyword defaults of `fn` (used to mirror Xtts.inference*)"""
+    return {
+        name: param.default
+        for name, param in inspect.signature(fn).parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+
+
+def split_text(model, text, language):
+    """Split `text` into sentences the way `inference_stream(enable_text_splitting=True)` does"""
+    language = language.split("-")[0]
+    return split_sentence(text, language, model.tokenizer.char_limits[language])
+
+
+class ScheduledRequest:
+    """What `MicroBatchScheduler` needs of a request.
+
+    `segments` holds the text tokens of the sentences left, last sentence
+    first. The scheduler hands each vocoded wav to `emit` and calls `finish`
+    once (with the error, if any) when the request is done; subclasses
+    decide where the audio goes. This base drops it.
+    """
+
+    def __init__(
+        self,
+        segments,
+        gpt_cond_latent,
+        speaker_embedding,
+        stream=False,
+        stream_chunk_size=20,
+        priority=PRIORITY_INTERACTIVE,
+        deadline=None,
+        submitted=None,
+        trace=None,
+    ):
+        self.segments = segments
+        self.gpt_cond_latent = gpt_cond_latent
+        self.speaker_embedding = speaker_embedding
+        self.stream = stream
+        self.stream_chunk_size = stream_chunk_size
+        self.priority = priority
+        # time.monotonic() after which the client has given up (None: no deadline)
+        self.deadline = deadline
+        self.submitted = time.monotonic() if submitted is None else submitted
+        # Stage -> seconds the scheduler spent on this request ("gpt", "vocoder")
+        self.timings = collections.defaultdict(float)
+        # List that collects torch.profiler events of the rounds this request is in
+        self.trace = trace
+        self.cancelled = False
+        self.error = None
+
+    def emit(self, wav):
+        pass
+
+    def finish(self, error=None):
+        self.error = error
+
+
+class SynthesisRequest(ScheduledRequest):
+    """One /tts or /tts_stream call, split into sentence segments.
+
+    The scheduler emits wav tensors (one per vocoded chunk for streaming
+    requests, one per sentence otherwise) from the inference thread; they are
+    handed over to the request's asyncio queue on the event loop it was
+    created on, followed by a sentinel.
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self,
+        text,
+        language,
+        gpt_cond_latent,
+        speaker_embedding,
+        stream=False,
+        stream_chunk_size=20,
+        split=None,
+        priority=PRIORITY_INTERACTIVE,
+        trace=None,
+        deadline=None,
+    ):
+        super().__init__(
+            [],
+            gpt_cond_latent,
+            speaker_embedding,
+            stream=stream,
+            stream_chunk_size=stream_chunk_size,
+            priority=priority,
+            deadline=deadline,
+            trace=trace,
+        )
+        self.text = text
+        self.language = language.split("-")[0]
+        # Like the endpoints always did: streams split into sentences, /tts doesn't
+        self.split = stream if split is None else split
+        # Set by executors that need to pass the cancellation on (see ReplicaPool)
+        self.on_cancel = None
+        self._loop = asyncio.get_running_loop()
+        self.outputs = asyncio.Queue()
+
+    def tokenize(self, backend):
+        """Split (if `split`, like `enable_text_splitting=True`) and tokenize the text with `backend`"""
+        if self.split:
+            sentences = backend.split(self.text, self.language)
+        else:
+            sentences = [self.text]
+        for sent in sentences:
+            self.segments.append(backend.tokenize(sent.strip().lower(), self.language))
+        self.segments.reverse()
+
+    def emit(self, wav):
+        self._loop.call_soon_threadsafe(self.outputs.put_nowait, wav)
+
+    def finish(self, error=None):
+        self.error = error
+        self._loop.call_soon_threadsafe(self.outputs.put_nowait, self._DONE)
+
+    def cancel(self):
+        """Stop synthesizing once the current sentence is done (client went away)"""
+        self.cancelled = True
+        if self.on_cancel is not None:
+            self.on_cancel()
+
+    async def __aiter__(self):
+        while True:
+            item = await self.outputs.get()
+            if item is self._DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    async def result(self):
+        """Wait until every segment is synthesized and return the joined wav"""
+        return torch.cat([wav async for wav in self], dim=0)
+
+
+class MicroBatchScheduler:
+    """Run concurrent synthesis requests through the GPT decoder together.
+
+    Requests that arrive within `max_wait_ms` of each other are grouped into a
+    batch of at most `max_batch_size`. Every round decodes the next sentence of
+    each request in the batch in a single left-padded GPT generate call, then
+    vocodes each sequence on its own. Multi-sentence requests are handed back
+    so newcomers can join at the next sentence boundary. The scheduler holds no
+    thread of its own: `InferenceExecutor` collects requests and calls
+    `run_batch` from its inference thread.
+
+    Within a priority, the requests with the least text left go first, so
+    short prompts don't wait behind chapter-length ones. Waiting lowers a
+    request's cost by `aging` text tokens per second, so long ones still
+    get their turn under steady load.
+
+    With `pipeline_depth` > 0, vocoding runs on a `VocoderStage` thread, so
+    the GPT decodes the next chunk or sentence while the previous one is
+    vocoded, with at most `pipeline_depth` chunks waiting in between.
+
+    `run_batch` may be called from several threads at once (INFERENCE_LANES):
+    each thread decodes with its own view of the GPT (see `_decoder`).
+    """
+
+    def __init__(self, model, max_batch_size=4, max_wait_ms=10, aging=20, pipeline_depth=0):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.aging = aging
+        self.vocoder = VocoderStage(pipeline_depth)
+        self.inference_kwargs, self.stream_kwargs = self._generation_defaults()
+        self._local = threading.local()
+
+    def _generation_defaults(self):
+        """Keyword defaults of `Xtts.inference` and `Xtts.inference_stream`"""
+        return default_kwargs(self.model.inference), default_kwargs(self.model.inference_stream)
+
+    def cost(self, request, now):
+        """Estimated work left in `request` (text tokens), less its waiting credit"""
+        tokens = sum(segment.shape[-1] for segment in request.segments)
+        return tokens - self.aging * (now - request.submitted)
+
+    def next_batch(self, pending):
+        """Pop up to `max_batch_size` requests of the same kind (stream or not) and priority.
+
+        The most urgent priority goes first, cheapest first within it; requests
+        of different priorities never share a batch. Requests past their
+        deadline are dropped from `pending` and finished with `DeadlineExceeded`.
+        """
+        now = time.monotonic()
+        for request in [request for request in pending if request.deadline is not None and now > request.deadline]:
+            pending.remove(request)
+            self.vocoder.finish(request, DeadlineExceeded("The request's deadline passed while it was queued."))
+        if not pending:
+            return []
+        ordered = sorted(pending, key=lambda request: (request.priority, self.cost(request, now)))
+        stream, priority = ordered[0].stream, ordered[0].priority
+        batch = [request for request in ordered if request.stream == stream and request.priority == priority]
+        batch = batch[: self.max_batch_size]
+        chosen = {id(request) for request in batch}
+        rest = [request for request in pending if id(request) not in chosen]
+        pending.clear()
+        pending.extend(rest)
+        return batch
+
+    def run_batch(self, batch):
+        """Synthesize the next sentence of every request in `batch`.
+
+        Returns the requests that still have sentences left; every other
+        request is finished (with its error, if the batch failed) once its
+        audio has been vocoded.
+        """
+        now = time.monotonic()
+        for request in batch:
+            if request.cancelled:
+                self.vocoder.finish(request)
+            elif request.deadline is not None and now > request.deadline:
+                request.cancelled = True
+                self.vocoder.finish(request, DeadlineExceeded("The request's deadline passed before it was done."))
+        batch = [request for request in batch if not request.cancelled]
+        if not batch:
+            return []
+        try:
+            with torch.inference_mode(), trace_round([request for request in batch if request.trace is not None]):
+                if batch[0].stream:
+                    self._run_stream_batch(batch)
+                else:
+                    self._run_batch(batch)
+        except Exception as e:
+            for request in batch:
+                self.vocoder.finish(request, e)
+            return []
+        remaining = []
+        for request in batch:
+            if request.segments and not request.cancelled:
+                remaining.append(request)
+            else:
+                self.vocoder.finish(request)
+        return remaining
+
+    def _decoder(self):
+        """The calling thread's `GPT2InferenceModel`.
+
+        `store_prefix_emb` keeps the batch's [cond | text] prefix on the module,
+        where every decode step reads it, so batches running at the same time
+        can't share one. Each thread gets a shallow copy: it has its own prefix
+        but shares the weights and submodules (including those swapped in by
+        COMPILE or PRECISION) with the model.
+        """
+        decoder = getattr(self._local, "decoder", None)
+        if decoder is None:
+            decoder = self._local.decoder = copy.copy(self.model.gpt.gpt_inference)
+        return decoder
+
+    def _gpt_inputs(self, batch, decoder):
+        """Batched equivalent of `GPT.compute_embeddings` using left padding.
+
+        The XTTS GPT has no built-in position embeddings (`wpe` is nulled), so
+        left-padding the [cond | text] prefix and masking it out keeps every
+        sequence's audio tokens aligned without changing its positions. The
+        prefix is stored on `decoder`.
+        """
+        gpt = self.model.gpt
+        device = self.model.device
+        text_tokens, embs = [], []
+        for request in batch:
+            tokens = request.segments.pop().to(device)
+            text_tokens.append(tokens)
+            padded = F.pad(tokens, (0, 1), value=gpt.stop_text_token)
+            padded = F.pad(padded, (1, 0), value=gpt.start_text_token)
+            emb = gpt.text_embedding(padded) + gpt.text_pos_embedding(padded)
+            embs.append(torch.cat([request.gpt_cond_latent.to(device), emb], dim=1))
+
+        max_len = max(emb.shape[1] for emb in embs)
+        prefix = embs[0].new_zeros((len(embs), max_len, embs[0].shape[-1]))
+        attention_mask = torch.zeros((len(embs), max_len + 1), dtype=torch.long, device=device)
+        for i, emb in enumerate(embs):
+            prefix[i, max_len - emb.shape[1] :] = emb[0]
+            attention_mask[i, max_len - emb.shape[1] :] = 1
+        decoder.store_prefix_emb(prefix)
+
+        gpt_inputs = torch.full((len(embs), max_len + 1), fill_value=1, dtype=torch.long, device=device)
+        gpt_inputs[:, -1] = gpt.start_audio_token
+        return text_tokens, gpt_inputs, attention_mask
+
+    def _sampling_kwargs(self, defaults):
+        return {
+            "do_sample": defaults["do_sample"],
+            "top_p": defaults["top_p"],
+            "top_k": defaults["top_k"],
+            "temperature": defaults["temperature"],
+            "length_penalty": float(defaults["length_penalty"]),
+            "repetition_penalty": float(defaults["repetition_penalty"]),
+        }
+
+    def _run_batch(self, batch):
+        """Batched `Xtts.inference`: one generate call, per-request latents and vocoding"""
+        model, gpt = self.model, self.model.gpt
+        start = time.perf_counter()
+        decoder = self._decoder()
+        text_tokens, gpt_inputs, attention_mask = self._gpt_inputs(batch, decoder)
+        gen = decoder.generate(
+            gpt_inputs,
+            attention_mask=attention_mask,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+            num_return_sequences=1,
+            num_beams=self.inference_kwargs["num_beams"],
+            output_attentions=False,
+            **self._sampling_kwargs(self.inference_kwargs),
+        )
+        all_codes = gen[:, gpt_inputs.shape[1] :]
+        elapsed = time.perf_counter() - start
+        for request in batch:
+            request.timings["gpt"] += elapsed
+
+        for request, tokens, codes in zip(batch, text_tokens, all_codes):
+            start = time.perf_counter()
+            stop = (codes == gpt.stop_audio_token).nonzero()
+            if len(stop):
+                codes = codes[: stop[0, 0] + 1]
+            expected_output_len = torch.tensor([codes.shape[-1] * gpt.code_stride_len], device=model.device)
+            text_len = torch.tensor([tokens.shape[-1]], device=model.device)
+            gpt_latents = gpt(
+                tokens,
+                text_len,
+                codes[None],
+                expected_output_len,
+                cond_latents=request.gpt_cond_latent.to(model.device),
+                return_attentions=False,
+                return_latent=True,
+            )
+            request.timings["gpt"] += time.perf_counter() - start
+            self.vocoder.vocode(request, functools.partial(self._vocode, request, gpt_latents))
+
+    def _vocode(self, request, gpt_latents):
+        """Whole-sentence vocoding of `_run_batch`"""
+        model = self.model
+        start = time.perf_counter()
+        wav = model.hifigan_decoder(gpt_latents, g=request.speaker_embedding.to(model.device)).cpu().squeeze()
+        request.timings["vocoder"] += time.perf_counter() - start
+        return wav
+
+    def _run_stream_batch(self, batch):
+        """Batched `Xtts.inference_stream` for one sentence of each request"""
+        model, gpt = self.model, self.model.gpt
+        overlap_wav_len = self.stream_kwargs["overlap_wav_len"]
+        start = time.perf_counter()
+        handing_over = 0.0
+        decoder = self._decoder()
+        _, gpt_inputs, attention_mask = self._gpt_inputs(batch, decoder)
+        # `GPT.get_generator`, on this thread's decoder (`generate_stream` is
+        # the streaming `generate` that `init_stream_support` adds)
+        generator = decoder.generate_stream(
+            gpt_inputs,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+            do_stream=True,
+            attention_mask=attention_mask,
+            num_beams=1,
+            num_return_sequences=1,
+            output_attentions=False,
+            output_hidden_states=True,
+            **self._sampling_kwargs(self.stream_kwargs),
+        )
+
+        states = [
+            {"tokens": 0, "latents": [], "wav_gen_prev": None, "wav_overlap": None, "done": False}
+            for _ in batch
+        ]
+
+        def vocode(request, state, gpt_latents):
+            vocode_start = time.perf_counter()
+            wav_gen = model.hifigan_decoder(gpt_latents, g=request.speaker_embedding.to(model.device))
+            # The overlap state is only touched here, in order, by one thread at a time
+            wav_chunk, state["wav_gen_prev"], state["wav_overlap"] = model.handle_chunks(
+                wav_gen.squeeze(), state["wav_gen_prev"], state["wav_overlap"], overlap_wav_len
+            )
+            request.timings["vocoder"] += time.perf_counter() - vocode_start
+            return wav_chunk
+
+        def flush(request, state):
+            nonlocal handing_over
+            flush_start = time.perf_counter()
+            # Every latent so far: XTTS vocodes the whole prefix and cuts out the new part
+            gpt_latents = torch.cat(state["latents"], dim=0)[None, :]
+            state["tokens"] = 0
+            self.vocoder.vocode(request, functools.partial(vocode, request, state, gpt_latents))
+            handing_over += time.perf_counter() - flush_start
+
+        for x, latent in generator:
+            for i, (request, state) in enumerate(zip(batch, states)):
+                if state["done"]:
+                    continue
+                state["tokens"] += 1
+                state["latents"].append(latent[i : i + 1])
+                if x[i] == gpt.stop_audio_token:
+                    state["done"] = True
+                    flush(request, state)
+                elif request.stream_chunk_size > 0 and state["tokens"] >= request.stream_chunk_size:
+                    flush(request, state)
+
+        # Sequences that hit max_length without a stop token
+        for request, state in zip(batch, states):
+            if not state["done"] and state["tokens"]:
+                flush(request, state)
+
+        # Everything but vocoding (inline) or waiting for the vocoder was spent
+        # decoding, on behalf of the whole batch
+        elapsed = time.perf_counter() - start - handing_over
+        for request in batch:
+            request.timings["gpt"] += elapsed
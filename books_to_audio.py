@@ -7,6 +7,7 @@ from docx import Document
 import re
 import ebooklib
 import requests
+import time
 from ebooklib import epub
 from bs4 import BeautifulSoup
 import gradio as gr
@@ -33,6 +34,9 @@ elif os.path.exists(os.path.join(OUTPUT, "cloned_speakers")):
 
 try:
     print("Getting metadata from server ...")
+    # The server answers 503 until the model is loaded
+    while requests.get(SERVER_URL + "/ready").status_code == 503:
+        time.sleep(2)
     LANGUAGES = requests.get(SERVER_URL + "/languages").json()
     print("Available languages:", ", ".join(LANGUAGES))
     STUDIO_SPEAKERS = requests.get(SERVER_URL + "/studio_speakers").json()
@@ -0,0 +1,73 @@
+import time
+
+import torch
+
+from batching import ScheduledRequest
+
+WARMUP_TEXT = "It took me quite a long time to develop a voice and now that I have it I am not going to be silent. "
+
+
+class WarmupRequest(ScheduledRequest):
+    """Synthetic request run through the scheduler while warming up; the audio is dropped"""
+
+    def __init__(self, tokens, gpt_cond_latent, speaker_embedding, stream):
+        super().__init__([tokens], gpt_cond_latent, speaker_embedding, stream=stream)
+
+
+def warm_up(model, scheduler, gpt_cond_latent, speaker_embedding, buckets, max_tokens=48):
+    """Run both batched paths over text-length buckets and batch sizes.
+
+    Generation is capped at `max_tokens` audio tokens, which is enough to
+    trace the decode step and the vocoder for the shapes production sees.
+    """
+    gpt = model.gpt
+    max_gen_mel_tokens = gpt.max_gen_mel_tokens
+    text = torch.IntTensor(model.tokenizer.encode(WARMUP_TEXT.strip().lower(), lang="en"))
+    gpt.max_gen_mel_tokens = max_tokens
+    try:
+        for stream in (True, False):
+            for batch_size in sorted({1, scheduler.max_batch_size}):
+                for length in buckets:
+                    tokens = text.repeat(-(-length // len(text)))[:length].unsqueeze(0)
+                    batch = [WarmupRequest(tokens, gpt_cond_latent, speaker_embedding, stream) for _ in range(batch_size)]
+                    start = time.perf_counter()
+                    scheduler.run_batch(batch)
+                    scheduler.vocoder.wait()
+                    for request in batch:
+                        if request.error is not None:
+                            raise request.error
+                    print(
+                        f"Warm-up {'stream' if stream else 'batch'} x{batch_size}, {length} text tokens:"
+                        f" {time.perf_counter() - start:.2f} s",
+                        flush=True,
+                    )
+    finally:
+        gpt.max_gen_mel_tokens = max_gen_mel_tokens
+
+
+def compile_model(model, scheduler, gpt_cond_latent, speaker_embedding, buckets, mode=None):
+    """Compile the GPT decode step and the HiFi-GAN generator, then warm them up.
+
+    Both are compiled with dynamic shapes, so the warm-up buckets cover the
+    sequence lengths and batch sizes seen in production without recompiling.
+    If compiling or the warm-up fails, the eager modules are put back.
+    Returns whether the compiled modules are in use.
+    """
+    import torch._dynamo
+
+    # A frame that fails to compile later on runs eagerly instead of failing the request
+    torch._dynamo.config.suppress_errors = True
+    gpt_inference = model.gpt.gpt_inference
+    hifigan_decoder = model.hifigan_decoder
+    transformer = gpt_inference.transformer
+    waveform_decoder = hifigan_decoder.waveform_decoder
+    try:
+        gpt_inference.transformer = torch.compile(transformer, dynamic=True, mode=mode)
+        hifigan_decoder.waveform_decoder = torch.compile(waveform_decoder, dynamic=True, mode=mode)
+        warm_up(model, scheduler, gpt_cond_latent, speaker_embedding, buckets)
+    except Exception as e:
+        print(f"torch.compile failed ({e!r}), running eagerly", flush=True)
+        gpt_inference.transformer = transformer
+        hifigan_decoder.waveform_decoder = waveform_decoder
+        return False
+    return True
@@ -0,0 +1,61 @@
+import os
+import threading
+
+import torch
+
+
+class CorePool:
+    """Split the CPU's cores between inference threads according to load.
+
+    A thread asks for cores before each batch round and gives them back
+    after it. It gets an equal share of the cores between the threads that
+    currently hold or want cores, so a lone batch uses the whole machine and
+    concurrent ones get disjoint sets. When the cores are all taken, a
+    thread waits for the next round boundary of the others, where shares
+    are recomputed.
+    """
+
+    def __init__(self, cores=None):
+        self.cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+        self.free = set(self.cores)
+        self.demand = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, count):
+        """Take `count` cores out of the pool for good and return them (call before any `run`)"""
+        with self._cond:
+            reserved = set(self.cores[len(self.cores) - count :])
+            self.cores = [core for core in self.cores if core not in reserved]
+            self.free -= reserved
+            return reserved
+
+    def acquire(self):
+        with self._cond:
+            self.demand += 1
+            while True:
+                share = max(1, len(self.cores) // self.demand)
+                if len(self.free) >= share:
+                    cores = set(sorted(self.free)[:share])
+                    self.free -= cores
+                    return cores
+                self._cond.wait()
+
+    def release(self, cores):
+        with self._cond:
+            self.free |= cores
+            self.demand -= 1
+            self._cond.notify_all()
+
+    def run(self, fn, *args, **kwargs):
+        """Run `fn` on the calling thread, pinned to a share of the cores with matching intra-op threads.
+
+        Affinity is best-effort: it applies to the calling thread and the
+        OpenMP workers it starts from now on.
+        """
+        cores = self.acquire()
+        try:
+            os.sched_setaffinity(0, cores)
+            torch.set_num_threads(len(cores))
+            return fn(*args, **kwargs)
+        finally:
+            self.release(cores)
@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+
+class InferenceExecutor:
+    """Owns the model (through its backend) and is the only place that calls into it.
+
+    Synthesis requests are put on an asyncio queue; a single background task
+    groups them into batches with the `MicroBatchScheduler` and runs each batch
+    on a dedicated inference thread. Audio flows back through each request's
+    own asyncio queue, so a slow client only holds a coroutine, never a thread.
+    Other model work (speaker cloning) goes through `call` and is serialized on
+    the same thread.
+
+    With `lanes` > 1, up to that many batches run at once on their own
+    threads, each on the share of the CPU cores `core_pool` gives it for the
+    round.
+    """
+
+    def __init__(self, backend, scheduler, lanes=1, core_pool=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.lanes = lanes
+        self.core_pool = core_pool
+        self.queue = None
+        # Requests between batch rounds, waiting for a lane
+        self.pending = collections.deque()
+        self._task = None
+        self._thread = ThreadPoolExecutor(max_workers=lanes, thread_name_prefix="xtts-inference")
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._thread.shutdown(wait=False)
+
+    async def submit(self, request):
+        """Tokenize `request` off the event loop and queue it for synthesis"""
+        await run_in_threadpool(request.tokenize, self.backend)
+        self.queue.put_nowait(request)
+        return request
+
+    def depth(self):
+        """Requests waiting for the model: queued or between sentence rounds"""
+        return (self.queue.qsize() if self.queue is not None else 0) + len(self.pending)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run `fn` on an inference thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        if self.core_pool is not None:
+            return await loop.run_in_executor(self._thread, functools.partial(self.core_pool.run, fn, *args, **kwargs))
+        return await loop.run_in_executor(self._thread, functools.partial(fn, *args, **kwargs))
+
+    def _drain(self, pending):
+        """Move every queued request to `pending` without waiting"""
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+
+    async def _collect(self, pending):
+        """Move every queued request to `pending`, waiting up to the batch window when idle.
+
+        Requests between sentence rounds stay in `pending`, so it is drained
+        in full: `next_batch` must see every newcomer to pick by priority and
+        cost, not only those that fit in a free batch slot.
+        """
+        if pending:
+            self._drain(pending)
+            return
+        pending.append(await self.queue.get())
+        deadline = asyncio.get_running_loop().time() + self.scheduler.max_wait
+        while len(pending) < self.scheduler.max_batch_size:
+            try:
+                timeout = max(0, deadline - asyncio.get_running_loop().time())
+                pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._drain(pending)
+
+    async def _run(self):
+        pending = self.pending
+        if self.lanes == 1:
+            while True:
+                await self._collect(pending)
+                batch = self.scheduler.next_batch(pending)
+                if batch:
+                    pending.extend(await self.call(self.scheduler.run_batch, batch))
+
+        running = set()
+        while True:
+            # Newcomers join at the next sentence boundary, like with one lane
+            self._drain(pending)
+            while pending and len(running) < self.lanes:
+                batch = self.scheduler.next_batch(pending)
+                if not batch:
+                    break
+                running.add(asyncio.ensure_future(self.call(self.scheduler.run_batch, batch)))
+            if not running:
+                await self._collect(pending)
+                continue
+            waiters = set(running)
+            arrival = None
+            if len(running) < self.lanes:
+                # A free lane: start a new request after the batch window
+                arrival = asyncio.ensure_future(self._collect(pending))
+                waiters.add(arrival)
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            if arrival is not None and arrival not in done:
+                # Requests it already took stay in `pending`
+                arrival.cancel()
+            for task in done & running:
+                running.discard(task)
+                pending.extend(task.result())
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from storage import write_atomic
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    language TEXT NOT NULL,
+    output_format TEXT NOT NULL,
+    output_profile TEXT,
+    gpt_cond_latent BLOB NOT NULL,
+    speaker_embedding BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    job_id TEXT NOT NULL REFERENCES jobs(id),
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS segments_by_status ON segments(status);
+"""
+
+# Segment statuses
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def pack_segments(sentences, max_chars):
+    """Group consecutive sentences into segments of at most `max_chars` (longer sentences stay whole)"""
+    segments, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+class JobStore:
+    """Long synthesis jobs, queued in SQLite so they survive a restart.
+
+    A job is a list of text segments synthesized one after the other; each
+    finished segment is written to `<directory>/<job id>/<index>.<ext>` and can
+    be downloaded while the rest of the job is still running. Segments that
+    were running when the server stopped are queued again on startup.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "jobs.sqlite"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            self._db.execute("UPDATE segments SET status = ? WHERE status = ?", (PENDING, RUNNING))
+
+    def segment_path(self, job_id, index, extension):
+        return os.path.join(self.directory, job_id, f"{index:05d}.{extension}")
+
+    def create(self, segments, language, output_format, output_profile, gpt_cond_latent, speaker_embedding):
+        """Queue a job (latents as float16 bytes) and return its id"""
+        job_id = uuid.uuid4().hex
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, created, language, output_format, output_profile, gpt_cond_latent, speaker_embedding)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, time.time(), language, output_format, output_profile, gpt_cond_latent, speaker_embedding),
+            )
+            self._db.executemany(
+                "INSERT INTO segments (job_id, idx, text) VALUES (?, ?, ?)",
+                [(job_id, i, text) for i, text in enumerate(segments)],
+            )
+        os.makedirs(os.path.join(self.directory, job_id), exist_ok=True)
+        return job_id
+
+    def job(self, job_id):
+        """Return the job row as a dict, or None if unknown"""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def segments(self, job_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT idx, status, error FROM segments WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(self):
+        """Mark the next pending segment (oldest job first) as running and return `(job, index, text)`, or None"""
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT s.job_id, s.idx, s.text FROM segments s JOIN jobs j ON j.id = s.job_id"
+                " WHERE s.status = ? AND j.cancelled = 0 ORDER BY j.created, s.idx LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE segments SET status = ? WHERE job_id = ? AND idx = ?", (RUNNING, row["job_id"], row["idx"])
+            )
+            job = dict(self._db.execute("SELECT * FROM jobs WHERE id = ?", (row["job_id"],)).fetchone())
+        return job, row["idx"], row["text"]
+
+    def write_segment(self, job_id, index, extension, data):
+        """Store a finished segment's audio (written to a temp file, then renamed into place)"""
+        write_atomic(self.segment_path(job_id, index, extension), lambda f: f.write(data))
+        self.finish_segment(job_id, index)
+
+    def finish_segment(self, job_id, index, error=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE segments SET status = ?, error = ? WHERE job_id = ? AND idx = ?",
+                (FAILED if error is not None else DONE, error, job_id, index),
+            )
+
+    def requeue_segment(self, job_id, index):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE segments SET status = ? WHERE job_id = ? AND idx = ? AND status = ?",
+                (PENDING, job_id, index, RUNNING),
+            )
+
+    def cancel(self, job_id):
+        """Stop a job: its pending segments are never synthesized, finished ones stay available"""
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET cancelled = 1 WHERE id = ?", (job_id,))
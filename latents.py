@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import time
+from typing import List, Union
+
+import msgpack
+import numpy as np
+import torch
+from fastapi.routing import APIRoute
+from pydantic import StrictBytes, StrictStr
+from starlette.requests import Request
+
+# A latent may be sent as nested JSON floats, as a base64 string of float16
+# (or of a .npy file) in a JSON body, or as raw float16/.npy bytes in a
+# msgpack body.
+GptCondLatent = Union[List[List[float]], StrictStr, StrictBytes]
+SpeakerEmbedding = Union[List[float], StrictStr, StrictBytes]
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+NPZ_TYPE = "application/x-npz"
+ENCODINGS = ("json", "base64", "msgpack", "npz")
+NPY_MAGIC = b"\x93NUMPY"
+# Scope key of the `time.perf_counter()` at which a request reached its route
+RECEIVED = "xtts.received"
+# Width of a GPT conditioning latent row and size of a speaker embedding (XTTS v2)
+GPT_COND_DIM = 1024
+SPEAKER_EMBEDDING_SIZE = 512
+
+
+def is_msgpack(content_type):
+    return content_type.split(";")[0].strip().lower() in MSGPACK_TYPES
+
+
+def negotiate_encoding(encoding, accept):
+    """Pick the latent encoding of a response from `?encoding=` or the Accept header"""
+    if encoding is not None:
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding!r}, use one of {', '.join(ENCODINGS)}.")
+        return encoding
+    accept = (accept or "").lower()
+    if any(t in accept for t in MSGPACK_TYPES):
+        return "msgpack"
+    if NPZ_TYPE in accept:
+        return "npz"
+    return "json"
+
+
+def decode_array(value):
+    """Turn a base64/raw float16 buffer or a .npy file into a float32 array without Python lists"""
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    if value[: len(NPY_MAGIC)] == NPY_MAGIC:
+        return np.load(io.BytesIO(value), allow_pickle=False).astype(np.float32)
+    return np.frombuffer(value, dtype=np.float16).astype(np.float32)
+
+
+def check_latent_sizes(gpt_cond_latent, speaker_embedding):
+    """Raise ValueError unless the decoded latents can be shaped for inference"""
+    if gpt_cond_latent.numel() == 0 or gpt_cond_latent.numel() % GPT_COND_DIM:
+        raise ValueError(
+            f"gpt_cond_latent has {gpt_cond_latent.numel()} values, expected a multiple of {GPT_COND_DIM}."
+        )
+    if speaker_embedding.numel() != SPEAKER_EMBEDDING_SIZE:
+        raise ValueError(
+            f"speaker_embedding has {speaker_embedding.numel()} values, expected {SPEAKER_EMBEDDING_SIZE}."
+        )
+
+
+def to_fp16_bytes(tensor):
+    return tensor.detach().cpu().squeeze().half().numpy().tobytes()
+
+
+def encode_speaker(gpt_cond_latent, speaker_embedding, encoding):
+    """Latents of one speaker as a JSON/msgpack-ready dict"""
+    if encoding == "json":
+        return {
+            "gpt_cond_latent": gpt_cond_latent.cpu().squeeze().half().tolist(),
+            "speaker_embedding": speaker_embedding.cpu().squeeze().half().tolist(),
+        }
+    gpt_cond_latent = to_fp16_bytes(gpt_cond_latent)
+    speaker_embedding = to_fp16_bytes(speaker_embedding)
+    if encoding == "base64":
+        gpt_cond_latent = base64.b64encode(gpt_cond_latent).decode("ascii")
+        speaker_embedding = base64.b64encode(speaker_embedding).decode("ascii")
+    return {"gpt_cond_latent": gpt_cond_latent, "speaker_embedding": speaker_embedding}
+
+
+def encode_npz(speakers):
+    """Pack `{name: (gpt_cond_latent, speaker_embedding)}` as an uncompressed .npz of float16 .npy members"""
+    arrays = {}
+    for name, (gpt_cond_latent, speaker_embedding) in speakers.items():
+        prefix = f"{name}/" if name else ""
+        arrays[prefix + "gpt_cond_latent"] = gpt_cond_latent.detach().cpu().squeeze().half().numpy()
+        arrays[prefix + "speaker_embedding"] = speaker_embedding.detach().cpu().squeeze().half().numpy()
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+
+class LatentDecoder:
+    """Decode inline latents into tensors, memoized by a hash of their bytes.
+
+    Decoded tensors are kept in a `SpeakerRegistry` keyed by content hash, so a
+    client re-sending the same base64/msgpack latents skips the conversion and
+    the host-to-device copy.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def decode(self, gpt_cond_latent, speaker_embedding):
+        """Return `(gpt_cond_latent, speaker_embedding)` shaped for inference.
+
+        Raises ValueError for latents that don't decode or have the wrong size.
+        """
+        if isinstance(gpt_cond_latent, list) or isinstance(speaker_embedding, list):
+            gpt_cond_latent = torch.tensor(gpt_cond_latent if isinstance(gpt_cond_latent, list) else decode_array(gpt_cond_latent))
+            speaker_embedding = torch.tensor(speaker_embedding if isinstance(speaker_embedding, list) else decode_array(speaker_embedding))
+            check_latent_sizes(gpt_cond_latent, speaker_embedding)
+            return gpt_cond_latent.reshape((-1, GPT_COND_DIM)).unsqueeze(0), speaker_embedding.reshape((1, -1, 1))
+        digest = hashlib.blake2b(digest_size=16)
+        for value in (gpt_cond_latent, speaker_embedding):
+            digest.update(value.encode("ascii") if isinstance(value, str) else value)
+            digest.update(b"\0")
+        key = digest.hexdigest()
+        if key in self.registry:
+            return self.registry.get(key)
+        gpt_cond_latent = torch.from_numpy(decode_array(gpt_cond_latent))
+        speaker_embedding = torch.from_numpy(decode_array(speaker_embedding))
+        check_latent_sizes(gpt_cond_latent, speaker_embedding)
+        return self.registry.put(key, gpt_cond_latent, speaker_embedding)
+
+
+def received_at(request):
+    """When `request` reached its route (see `MsgpackRoute`), or None"""
+    return request.scope.get(RECEIVED)
+
+
+class MsgpackRoute(APIRoute):
+    """APIRoute that also accepts msgpack request bodies.
+
+    The body is unpacked into the same dict a JSON body would produce (binary
+    fields stay `bytes`) and handed to the regular pydantic validation. The
+    time the request arrived is kept in its scope (`received_at`), so the
+    body parsing and validation that happen before the endpoint runs can be
+    timed.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            request.scope[RECEIVED] = time.perf_counter()
+            if is_msgpack(request.headers.get("content-type", "")):
+                body = await request.body()
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (key, b"application/json" if key == b"content-type" else value)
+                    for key, value in request.scope["headers"]
+                ]
+                request = Request(scope, request.receive)
+                request._body = body
+                request._json = msgpack.unpackb(body, raw=False)
+            return await handler(request)
+
+        return route_handler
@@ -0,0 +1,78 @@
+import contextlib
+import os
+import time
+
+import torch
+
+from storage import write_atomic
+
+
+class StartupPhases:
+    """Time and log each phase of startup; `phase` is what is running now"""
+
+    def __init__(self):
+        self.phase = "starting"
+        self.timings = {}
+        self.error = None
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def __call__(self, phase):
+        self.phase = phase
+        start = time.perf_counter()
+        yield
+        self.timings[phase] = round(time.perf_counter() - start, 3)
+        print(f"Startup phase {phase!r} took {self.timings[phase]:.2f} s", flush=True)
+
+    def done(self):
+        self.phase = "ready"
+        self.timings["total"] = round(time.perf_counter() - self._start, 3)
+        print(f"Startup took {self.timings['total']:.2f} s", flush=True)
+
+
+def snapshot_path(snapshot_dir, model_version):
+    return os.path.join(snapshot_dir, f"xtts-{model_version}.pt")
+
+
+def load_checkpoint(model, config, model_path, use_deepspeed, snapshot=None):
+    """`Xtts.load_checkpoint`, taking the weights from a snapshot when there is one.
+
+    A snapshot is the state dict that `load_checkpoint` ends up loading
+    (training-only weights already dropped) saved with `torch.save`, so it is
+    opened with `mmap=True`: pages are read as they are copied into the model
+    instead of unpickling the whole training checkpoint first. Returns the
+    state dict read from `model.pth` (to write a snapshot from), or None if
+    the snapshot was used.
+    """
+    if snapshot is not None and os.path.exists(snapshot):
+        model.get_compatible_checkpoint_state_dict = lambda _: torch.load(
+            snapshot, map_location="cpu", mmap=True, weights_only=True
+        )
+        try:
+            model.load_checkpoint(config, checkpoint_dir=model_path, eval=True, use_deepspeed=use_deepspeed)
+            return None
+        except Exception as e:
+            print(f"Could not load snapshot {snapshot} ({e!r}), loading the checkpoint instead", flush=True)
+            os.remove(snapshot)
+        finally:
+            del model.get_compatible_checkpoint_state_dict
+
+    loaded = {}
+    load_state_dict = model.get_compatible_checkpoint_state_dict
+
+    def keep(path):
+        loaded["state_dict"] = load_state_dict(path)
+        return loaded["state_dict"]
+
+    model.get_compatible_checkpoint_state_dict = keep
+    try:
+        model.load_checkpoint(config, checkpoint_dir=model_path, eval=True, use_deepspeed=use_deepspeed)
+    finally:
+        del model.get_compatible_checkpoint_state_dict
+    return loaded.get("state_dict")
+
+
+def write_snapshot(state_dict, snapshot):
+    """Save a snapshot (to a temp file, then renamed into place)"""
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    write_atomic(snapshot, lambda f: torch.save(state_dict, f))
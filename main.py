@@ -1,46 +1,270 @@
+import asyncio
 import base64
+import collections
+import hashlib
 import io
+import json
+import msgpack
+import multiprocessing
 import os
 import tempfile
+import time
 import wave
 import torch
 import numpy as np
-from typing import List
-from pydantic import BaseModel
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ValidationError
 
-from fastapi import FastAPI, UploadFile, Body
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, Body, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import Xtts
 from TTS.utils.generic_utils import get_user_data_dir
 from TTS.utils.manage import ModelManager
 
+from audio_cache import AudioCache
+from audio_formats import FFMPEG, OutputProfile, encode, media_type
+from backends import StubBackend, XttsBackend
+from batching import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    DeadlineExceeded,
+    SynthesisRequest,
+)
+from compilation import compile_model
+from cores import CorePool
+from executor import InferenceExecutor
+from jobs import DONE, JobStore, pack_segments
+from pcm import PcmWriter, samples
+from precision import apply_precision
+from profiling import ProfileStore, breakdown, server_timing
+from replicas import ReplicaPool, parse_cpus
+from responses import CachedBody, ReadinessGate
+from segmenter import TextSegmenter
+from loader import StartupPhases, load_checkpoint, snapshot_path, write_snapshot
+from metrics import ACTIVE_STREAMS, LOADED_SPEAKERS, QUEUE_DEPTH, RequestMetrics, metrics_body
+from latents import (
+    GptCondLatent,
+    LatentDecoder,
+    MsgpackRoute,
+    SpeakerEmbedding,
+    encode_npz,
+    encode_speaker,
+    negotiate_encoding,
+    received_at,
+    to_fp16_bytes,
+)
+from speakers import (
+    SpeakerRegistry,
+    expand_archive,
+    init_clone_worker,
+    load_reference_audio,
+    speaker_id_for,
+)
+
 torch.set_num_threads(int(os.environ.get("NUM_THREADS", os.cpu_count())))
-device = torch.device("cuda" if os.environ.get("USE_CPU", "0") == "0" else "cpu")
+# "xtts", or "stub" for a model-free stand-in (see backends.StubBackend)
+BACKEND = os.environ.get("BACKEND", "xtts")
+device = torch.device("cuda" if os.environ.get("USE_CPU", "0") == "0" and BACKEND != "stub" else "cpu")
 if not torch.cuda.is_available() and device == "cuda":
     raise RuntimeError("CUDA device unavailable, please use Dockerfile.cpu instead.") 
 
 custom_model_path = os.environ.get("CUSTOM_MODEL_PATH", "/app/tts_models")
+# Optional directory for memory-mappable weight snapshots (written after the first load)
+snapshot_dir = os.environ.get("MODEL_SNAPSHOT_DIR")
+
+
+def get_model_version(model_path):
+    """Identify the loaded weights by their config and checkpoint file"""
+    digest = hashlib.sha256()
+    with open(os.path.join(model_path, "config.json"), "rb") as f:
+        digest.update(f.read())
+    checkpoint = os.path.join(model_path, "model.pth")
+    if os.path.exists(checkpoint):
+        stat = os.stat(checkpoint)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+# Everything below that needs the model is set by `load()`, which runs in the
+# background once the server is accepting /health and /ready.
+startup = StartupPhases()
+ready = False
+backend = None
+model_version = None
+scheduler = None
+executor = None
+studio_speakers = {}
+clone_kwargs = None
+max_reference_seconds = None
+# (GPT, vocoder) precision in use, part of the audio cache keys
+precision = ("fp32", "fp32")
+
+
+def load_xtts():
+    """Download and load the XTTS weights, return `(backend, snapshot, state_dict)`"""
+    global model_version, precision
+
+    with startup("download"):
+        if os.path.exists(custom_model_path) and os.path.isfile(custom_model_path + "/config.json"):
+            model_path = custom_model_path
+            print("Loading custom model from", model_path, flush=True)
+        else:
+            print("Loading default model", flush=True)
+            model_name = "tts_models/multilingual/multi-dataset/xtts_v2"
+            print("Downloading XTTS Model:", model_name, flush=True)
+            ModelManager().download_model(model_name)
+            model_path = os.path.join(get_user_data_dir("tts"), model_name.replace("/", "--"))
+            print("XTTS Model downloaded", flush=True)
+        model_version = get_model_version(model_path)
+
+    print("Loading XTTS", flush=True)
+    with startup("init_model"):
+        config = XttsConfig()
+        config.load_json(os.path.join(model_path, "config.json"))
+        model = Xtts.init_from_config(config)
+    snapshot = snapshot_path(snapshot_dir, model_version) if snapshot_dir else None
+    with startup("load_snapshot" if snapshot is not None and os.path.exists(snapshot) else "load_checkpoint"):
+        state_dict = load_checkpoint(model, config, model_path, use_deepspeed=device.type == "cuda", snapshot=snapshot)
+    with startup("to_device"):
+        model.to(device)
+    print("XTTS Loaded.", flush=True)
+
+    gpt_precision = os.environ.get("PRECISION", "fp32")
+    vocoder_precision = os.environ.get("VOCODER_PRECISION", "fp32")
+    if (gpt_precision, vocoder_precision) != ("fp32", "fp32"):
+        if device.type == "cuda":
+            print("PRECISION and VOCODER_PRECISION only apply to CPU inference, ignoring them", flush=True)
+        else:
+            with startup("precision"):
+                precision = apply_precision(model, gpt_precision, vocoder_precision)
+            print(f"GPT precision {precision[0]}, vocoder precision {precision[1]}", flush=True)
+    return XttsBackend(model, config), snapshot, state_dict
+
+
+def load():
+    global backend, model_version, scheduler, executor, studio_speakers, clone_kwargs, max_reference_seconds
+
+    snapshot, state_dict = None, None
+    if BACKEND == "stub":
+        backend = StubBackend(token_ms=float(os.environ.get("STUB_TOKEN_MS", "10")))
+        model_version = "stub"
+        print(f"Using the stub backend ({backend.token_ms} ms per token), no model is loaded", flush=True)
+    else:
+        backend, snapshot, state_dict = load_xtts()
+
+    with startup("prepare"):
+        scheduler = backend.make_scheduler(
+            max_batch_size=int(os.environ.get("MAX_BATCH_SIZE", "4")),
+            max_wait_ms=float(os.environ.get("BATCH_WAIT_MS", "10")),
+            aging=float(os.environ.get("SJF_AGING", "20")),
+            pipeline_depth=int(os.environ.get("PIPELINE_DEPTH", "0")),
+        )
+        replicas = int(os.environ.get("REPLICAS", "1"))
+        if replicas > 1:
+            if device.type == "cuda":
+                raise RuntimeError("REPLICAS > 1 is only supported on CPU, set USE_CPU=1.")
+            replica_cpus = parse_cpus(os.environ.get("REPLICA_CPUS", "auto"), replicas)
+            executor = ReplicaPool(
+                backend,
+                scheduler,
+                replicas,
+                num_threads=int(
+                    os.environ.get("REPLICA_THREADS", len(replica_cpus[0]) if replica_cpus[0] else max(1, os.cpu_count() // replicas))
+                ),
+                cpus=replica_cpus,
+            )
+        else:
+            lanes = int(os.environ.get("INFERENCE_LANES", "1"))
+            if lanes > 1 and device.type == "cuda":
+                raise RuntimeError("INFERENCE_LANES > 1 is only supported on CPU, set USE_CPU=1.")
+            core_pool = None
+            if lanes > 1:
+                core_pool = CorePool()
+                if scheduler.vocoder.depth > 0 and len(core_pool.cores) > 1:
+                    # The vocoder thread serves every lane, so it gets cores of its own
+                    vocoder_cores = int(os.environ.get("VOCODER_CORES", max(1, len(core_pool.cores) // (lanes + 1))))
+                    scheduler.vocoder.pin(core_pool.reserve(min(vocoder_cores, len(core_pool.cores) - 1)))
+                    print(f"Vocoder thread pinned to cpus {sorted(scheduler.vocoder.cores)}", flush=True)
+            executor = InferenceExecutor(backend, scheduler, lanes=lanes, core_pool=core_pool)
+
+        studio_speakers = backend.studio_speakers()
+        for name, (gpt_cond_latent, speaker_embedding) in studio_speakers.items():
+            speakers.register(gpt_cond_latent, speaker_embedding, speaker_id=name, pinned=True)
+        studio_speakers_body("json")
+        studio_speakers_body("compact")
+
+        clone_kwargs = backend.clone_kwargs
+        max_reference_seconds = float(os.environ.get("MAX_REFERENCE_SECONDS", clone_kwargs["max_ref_length"]))
+
+    if os.environ.get("COMPILE", "0") == "1" and backend.name == "xtts":
+        if device.type == "cuda":
+            print("COMPILE=1 is only supported on CPU, running eagerly", flush=True)
+        else:
+            with startup("compile"):
+                if studio_speakers:
+                    warmup_latents = speakers.get(next(iter(studio_speakers)))
+                else:
+                    warmup_latents = (torch.zeros((1, 32, 1024), device=device), torch.zeros((1, 512, 1), device=device))
+                compile_model(
+                    backend.model,
+                    scheduler,
+                    *warmup_latents,
+                    buckets=[int(length) for length in os.environ.get("COMPILE_BUCKETS", "16,64,160").split(",")],
+                    mode=os.environ.get("COMPILE_MODE") or None,
+                )
+    return snapshot, state_dict
 
-if os.path.exists(custom_model_path) and os.path.isfile(custom_model_path + "/config.json"):
-    model_path = custom_model_path
-    print("Loading custom model from", model_path, flush=True)
-else:
-    print("Loading default model", flush=True)
-    model_name = "tts_models/multilingual/multi-dataset/xtts_v2"
-    print("Downloading XTTS Model:", model_name, flush=True)
-    ModelManager().download_model(model_name)
-    model_path = os.path.join(get_user_data_dir("tts"), model_name.replace("/", "--"))
-    print("XTTS Model downloaded", flush=True)
-
-print("Loading XTTS", flush=True)
-config = XttsConfig()
-config.load_json(os.path.join(model_path, "config.json"))
-model = Xtts.init_from_config(config)
-model.load_checkpoint(config, checkpoint_dir=model_path, eval=True, use_deepspeed=True if device == "cuda" else False)
-model.to(device)
-print("XTTS Loaded.", flush=True)
+
+speakers = SpeakerRegistry(device, max_speakers=int(os.environ.get("MAX_SPEAKERS", "256")))
+clone_cache = SpeakerRegistry(device, max_speakers=int(os.environ.get("CLONE_CACHE_SIZE", "128")))
+max_clone_files = int(os.environ.get("MAX_CLONE_FILES", "100"))
+# Uncompressed size limit of a zip archive uploaded to /clone_speakers
+max_clone_archive_bytes = int(os.environ.get("MAX_CLONE_ARCHIVE_BYTES", str(512 << 20)))
+# Spawned (not forked) so the workers don't inherit the CUDA context
+clone_pool = ProcessPoolExecutor(
+    max_workers=int(os.environ.get("CLONE_WORKERS", min(4, os.cpu_count()))),
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_clone_worker,
+)
+
+audio_cache_dir = os.environ.get("AUDIO_CACHE_DIR")
+audio_cache = AudioCache(audio_cache_dir, int(os.environ.get("AUDIO_CACHE_MAX_BYTES", str(1 << 30)))) if audio_cache_dir else None
+sentence_cache = None
+if audio_cache_dir and os.environ.get("SENTENCE_CACHE", "0") == "1":
+    sentence_cache = AudioCache(
+        os.path.join(audio_cache_dir, "sentences"),
+        int(os.environ.get("SENTENCE_CACHE_MAX_BYTES", str(1 << 30))),
+    )
+# Missing sentences queued ahead of the one being streamed
+SENTENCE_LOOKAHEAD = int(os.environ.get("SENTENCE_LOOKAHEAD", "2"))
+
+jobs_dir = os.environ.get("JOBS_DIR")
+jobs = JobStore(jobs_dir) if jobs_dir else None
+# Segments of a job are packed from whole sentences up to this many characters
+JOB_SEGMENT_CHARS = int(os.environ.get("JOB_SEGMENT_CHARS", "1000"))
+
+# Admission control: requests waiting for the model before new ones get a 429
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "64"))
+RETRY_AFTER = os.environ.get("RETRY_AFTER", "2")
+# Default deadline (seconds) of /tts and /tts_stream requests, unset for none
+REQUEST_TIMEOUT = float(os.environ["REQUEST_TIMEOUT"]) if os.environ.get("REQUEST_TIMEOUT") else None
+
+decoder = LatentDecoder(SpeakerRegistry(device, max_speakers=int(os.environ.get("LATENT_CACHE_SIZE", "64"))))
+
+# Opt-in per-request profiling, only for clients that send PROFILE_TOKEN
+profiles = ProfileStore(
+    os.environ.get("PROFILE_TOKEN") or None,
+    os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "xtts-profiles")),
+    keep=int(os.environ.get("PROFILE_KEEP", "20")),
+)
+
+QUEUE_DEPTH.set_function(lambda: executor.depth() if executor is not None else 0)
+LOADED_SPEAKERS.set_function(lambda: len(speakers))
 
 print("Running XTTS Server ...", flush=True)
 
@@ -51,32 +275,242 @@ app = FastAPI(
     version="0.0.1",
     docs_url="/",
 )
+app.router.route_class = MsgpackRoute
+
+# Paths served while the model is still loading
+STARTUP_PATHS = {"/health", "/ready", "/metrics", "/", "/openapi.json"}
+app.add_middleware(
+    ReadinessGate,
+    is_ready=lambda: ready,
+    paths=STARTUP_PATHS,
+    detail=lambda: {"detail": "The model is still loading.", "phase": startup.phase},
+)
+
+
+@app.get("/health")
+def get_health():
+    """Liveness: the process is up (fails only if loading the model failed)"""
+    if startup.error is not None:
+        return JSONResponse({"status": "failed", "phase": startup.phase, "error": startup.error}, status_code=500)
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def get_ready():
+    """Readiness: the model is loaded and requests can be served"""
+    if not ready:
+        return JSONResponse({"status": "loading", "phase": startup.phase, "timings": startup.timings}, status_code=503)
+    return {"status": "ready", "timings": startup.timings}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics"""
+    body, media_type = metrics_body()
+    return Response(body, media_type=media_type)
+
+
+async def load_in_background():
+    global ready
+    try:
+        snapshot, state_dict = await run_in_threadpool(load)
+        with startup("start_executor"):
+            executor.start()
+            if jobs is not None:
+                app.state.job_runner = asyncio.create_task(run_jobs())
+    except Exception as e:
+        startup.error = repr(e)
+        print(f"Startup failed in phase {startup.phase!r}: {e!r}", flush=True)
+        return
+    startup.done()
+    ready = True
+    if snapshot is not None and state_dict is not None:
+        try:
+            with startup("write_snapshot"):
+                await run_in_threadpool(write_snapshot, state_dict, snapshot)
+            print("Wrote model snapshot", snapshot, flush=True)
+        except OSError as e:
+            print(f"Could not write model snapshot {snapshot}: {e!r}", flush=True)
+
+
+@app.on_event("startup")
+async def start_loading():
+    app.state.loading = asyncio.create_task(load_in_background())
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if jobs is not None and hasattr(app.state, "job_runner"):
+        app.state.job_runner.cancel()
+    if executor is not None:
+        await executor.stop()
+    clone_pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def clone_latents(data):
+    """Conditioning latents of an uploaded clip, cached by a hash of its content"""
+    audio_hash = hashlib.sha256(data).hexdigest()
+    if audio_hash in clone_cache:
+        return clone_cache.get(audio_hash)
+    try:
+        audio = await run_in_threadpool(load_reference_audio, data, clone_kwargs["load_sr"], max_reference_seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode reference audio: {e}")
+    gpt_cond_latent, speaker_embedding = await executor.call(backend.conditioning_latents, audio)
+    clone_cache.register(gpt_cond_latent, speaker_embedding, speaker_id=audio_hash)
+    return gpt_cond_latent, speaker_embedding
+
+
+def get_encoding(request, encoding):
+    """Latent encoding for a response (json, base64, msgpack or npz)"""
+    try:
+        return negotiate_encoding(encoding, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def serialize_latents(payload, encoding, npz_speakers=None):
+    """Serialize a payload carrying latents in the negotiated encoding, return (body, media_type)"""
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+    if encoding == "npz":
+        return encode_npz(npz_speakers), "application/x-npz"
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8"), "application/json"
+
+
+def latents_response(payload, encoding, npz_speakers=None):
+    body, media_type = serialize_latents(payload, encoding, npz_speakers)
+    return Response(body, media_type=media_type)
 
 
 @app.post("/clone_speaker")
-def predict_speaker(wav_file: UploadFile):
+async def predict_speaker(wav_file: UploadFile, request: Request, encoding: Optional[str] = None):
     """Compute conditioning inputs from reference audio file."""
-    temp_audio_name = next(tempfile._get_candidate_names())
-    with open(temp_audio_name, "wb") as temp, torch.inference_mode():
-        temp.write(io.BytesIO(wav_file.file.read()).getbuffer())
-        gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(
-            temp_audio_name
-        )
-    return {
-        "gpt_cond_latent": gpt_cond_latent.cpu().squeeze().half().tolist(),
-        "speaker_embedding": speaker_embedding.cpu().squeeze().half().tolist(),
+    encoding = get_encoding(request, encoding)
+    gpt_cond_latent, speaker_embedding = await clone_latents(await wav_file.read())
+    speaker_id = speakers.register(gpt_cond_latent, speaker_embedding)
+    return latents_response(
+        {"speaker_id": speaker_id, **encode_speaker(gpt_cond_latent, speaker_embedding, encoding)},
+        encoding,
+        npz_speakers={"": (gpt_cond_latent, speaker_embedding)},
+    )
+
+
+@app.post("/clone_speakers")
+async def predict_speakers(
+    wav_files: List[UploadFile], request: Request, encoding: Optional[str] = None, ids_only: bool = False
+):
+    """Compute conditioning inputs for many reference files (or zip archives of them) at once."""
+    encoding = get_encoding(request, encoding)
+    if encoding == "npz":
+        raise HTTPException(status_code=400, detail="npz is not supported for /clone_speakers, use msgpack.")
+
+    clips = []
+    for wav_file in wav_files:
+        try:
+            clips.extend(
+                expand_archive(wav_file.filename, await wav_file.read(), max_clone_files, max_clone_archive_bytes)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    if len(clips) > max_clone_files:
+        raise HTTPException(status_code=413, detail=f"At most {max_clone_files} files can be cloned at once.")
+
+    # Identical files are decoded and encoded once; damaged archive members have no hash
+    hashes = [hashlib.sha256(data).hexdigest() if isinstance(data, bytes) else None for _, data in clips]
+    latents, errors = {}, {}
+    for audio_hash in hashes:
+        if audio_hash is not None and audio_hash in clone_cache:
+            latents[audio_hash] = clone_cache.get(audio_hash)
+    todo = {
+        audio_hash: data
+        for audio_hash, (_, data) in zip(hashes, clips)
+        if audio_hash is not None and audio_hash not in latents
     }
 
+    loop = asyncio.get_running_loop()
+    decoded = await asyncio.gather(
+        *[
+            loop.run_in_executor(clone_pool, load_reference_audio, data, clone_kwargs["load_sr"], max_reference_seconds)
+            for data in todo.values()
+        ],
+        return_exceptions=True,
+    )
+    audios = {}
+    for audio_hash, audio in zip(todo, decoded):
+        if isinstance(audio, Exception):
+            errors[audio_hash] = f"Could not decode reference audio: {audio}"
+        else:
+            audios[audio_hash] = audio
+
+    if audios:
+        computed = await executor.call(backend.batch_conditioning_latents, list(audios.values()))
+        for audio_hash, result in zip(audios, computed):
+            if isinstance(result, Exception):
+                errors[audio_hash] = f"Could not compute latents: {result}"
+            else:
+                clone_cache.register(*result, speaker_id=audio_hash)
+                latents[audio_hash] = result
 
-def postprocess(wav):
-    """Post process the output waveform"""
-    if isinstance(wav, list):
-        wav = torch.cat(wav, dim=0)
-    wav = wav.clone().detach().cpu().numpy()
-    wav = wav[None, : int(wav.shape[0])]
-    wav = np.clip(wav, -1, 1)
-    wav = (wav * 32767).astype(np.int16)
-    return wav
+    results = []
+    for (filename, data), audio_hash in zip(clips, hashes):
+        if audio_hash is None:
+            results.append({"file": filename, "error": f"Could not unpack archive: {data}"})
+            continue
+        if audio_hash in errors:
+            results.append({"file": filename, "error": errors[audio_hash]})
+            continue
+        gpt_cond_latent, speaker_embedding = latents[audio_hash]
+        result = {"file": filename, "speaker_id": speakers.register(gpt_cond_latent, speaker_embedding)}
+        if not ids_only:
+            result.update(encode_speaker(gpt_cond_latent, speaker_embedding, encoding))
+        results.append(result)
+    return latents_response({"speakers": results}, encoding)
+
+
+class SpeakerInputs(BaseModel):
+    speaker_embedding: SpeakerEmbedding
+    gpt_cond_latent: GptCondLatent
+
+
+@app.post("/register_speaker")
+async def register_speaker(parsed_input: SpeakerInputs):
+    """Keep conditioning latents on the server and return the id to synthesize with."""
+    try:
+        latents = decoder.decode(parsed_input.gpt_cond_latent, parsed_input.speaker_embedding)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Could not decode latents: {e}")
+    speaker_id = speakers.register(*latents)
+    return {"speaker_id": speaker_id}
+
+
+def get_latents(parsed_input):
+    """Return the conditioning latents for a request, by speaker_id or inline.
+
+    A speaker_id the server no longer knows (restart, eviction) falls back to
+    the inline latents when the request carries them too.
+    """
+    inline = parsed_input.speaker_embedding is not None and parsed_input.gpt_cond_latent is not None
+    if parsed_input.speaker_id is not None:
+        try:
+            return speakers.get(parsed_input.speaker_id)
+        except KeyError:
+            if not inline:
+                raise HTTPException(status_code=404, detail=f"Unknown speaker_id {parsed_input.speaker_id!r}, register it again.")
+    if not inline:
+        raise HTTPException(status_code=422, detail="Either speaker_id or speaker_embedding and gpt_cond_latent are required.")
+    try:
+        return decoder.decode(parsed_input.gpt_cond_latent, parsed_input.speaker_embedding)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Could not decode latents: {e}")
+
+
+OutputFormat = Literal["wav", "opus", "mp3", "flac"]
+# Raw PCM or G.711 in 20 ms frames, for telephony (see audio_formats.PROFILES)
+OutputProfileName = Literal["pcm16_24k", "pcm16_16k", "mulaw_8k", "alaw_8k"]
+
+# Samples per chunk when streaming audio from the cache (0.5 s)
+CACHED_STREAM_CHUNK = 12000
 
 
 def encode_audio_common(
@@ -99,87 +533,816 @@ def encode_audio_common(
 
 
 class StreamingInputs(BaseModel):
-    speaker_embedding: List[float]
-    gpt_cond_latent: List[List[float]]
+    speaker_id: Optional[str] = None
+    speaker_embedding: Optional[SpeakerEmbedding] = None
+    gpt_cond_latent: Optional[GptCondLatent] = None
     text: str
     language: str
     add_wav_header: bool = True
     stream_chunk_size: str = "20"
+    output_format: OutputFormat = "wav"
+    output_profile: Optional[OutputProfileName] = None
+    profile: bool = False
+    profile_trace: bool = False
+    # Seconds after which the client no longer wants the audio
+    timeout: Optional[float] = None
+
+
+def audio_cache_key(kind, text, language, speaker_hash, params):
+    """Key of a synthesized audio (whole request or single sentence) in the audio caches"""
+    return AudioCache.key(model_version, precision, kind, text, language, speaker_hash, params)
+
 
+def synthesis_params(stream, stream_chunk_size):
+    """Everything besides text, language and speaker that shapes the synthesized audio"""
+    if stream:
+        return dict(scheduler.stream_kwargs, stream_chunk_size=stream_chunk_size)
+    return dict(scheduler.inference_kwargs, enable_text_splitting=sentence_cache is not None)
 
-def predict_streaming_generator(parsed_input: dict = Body(...)):
-    speaker_embedding = torch.tensor(parsed_input.speaker_embedding).unsqueeze(0).unsqueeze(-1)
-    gpt_cond_latent = torch.tensor(parsed_input.gpt_cond_latent).reshape((-1, 1024)).unsqueeze(0)
+
+def write_pcm(writer, wav, metrics=None):
+    """`writer.write(wav)`, timed as the postprocess stage"""
+    if metrics is None:
+        return writer.write(wav)
+    start = time.perf_counter()
+    chunk = writer.write(wav)
+    metrics.add("postprocess", time.perf_counter() - start)
+    return chunk
+
+
+async def synthesize(
+    text,
+    language,
+    gpt_cond_latent,
+    speaker_embedding,
+    stream=False,
+    stream_chunk_size=20,
+    split=None,
+    priority=PRIORITY_INTERACTIVE,
+    metrics=None,
+    deadline=None,
+):
+    """Yield the int16 PCM of `text` chunk by chunk, as byte memoryviews.
+
+    A chunk is only valid until the next one is requested (see `PcmWriter`),
+    so callers that keep the audio must copy it. With the sentence cache on, the text is split like `inference_stream`
+    does and only sentences missing from the cache are synthesized; the next
+    `SENTENCE_LOOKAHEAD` missing ones are queued early so they can share a
+    batch with the current one. Stage timings go to `metrics`, if given.
+    """
+    if sentence_cache is None:
+        request = await executor.submit(
+            SynthesisRequest(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                stream=stream,
+                stream_chunk_size=stream_chunk_size,
+                split=split,
+                priority=priority,
+                trace=metrics.trace if metrics is not None else None,
+                deadline=deadline,
+            )
+        )
+        writer = PcmWriter()
+        try:
+            async for wav in request:
+                yield write_pcm(writer, wav, metrics)
+        finally:
+            request.cancel()
+            if metrics is not None:
+                metrics.update(request.timings)
+        return
+
+    speaker_hash = speaker_id_for(gpt_cond_latent, speaker_embedding)
+    params = synthesis_params(stream, stream_chunk_size)
+    sentences = await run_in_threadpool(backend.split, text, language)
+    keys = [audio_cache_key("sentence", sentence, language, speaker_hash, params) for sentence in sentences]
+    cached = [sentence_cache.get(key) for key in keys]
+    requests = {}
+
+    async def submit(i):
+        if i < len(sentences) and cached[i] is None and i not in requests:
+            requests[i] = await executor.submit(
+                SynthesisRequest(
+                    sentences[i],
+                    language,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    stream=stream,
+                    stream_chunk_size=stream_chunk_size,
+                    split=False,
+                    priority=priority,
+                    trace=metrics.trace if metrics is not None else None,
+                    deadline=deadline,
+                )
+            )
+
+    try:
+        for i in range(len(sentences)):
+            for j in range(i, i + SENTENCE_LOOKAHEAD + 1):
+                await submit(j)
+            if cached[i] is not None:
+                yield memoryview(cached[i]).cast("B")
+                continue
+            writer = PcmWriter(keep=True)
+            async for wav in requests[i]:
+                yield write_pcm(writer, wav, metrics)
+            if metrics is not None:
+                metrics.update(requests[i].timings)
+            del requests[i]
+            await run_in_threadpool(sentence_cache.put, keys[i], writer.pcm())
+    finally:
+        for request in requests.values():
+            request.cancel()
+
+
+async def stream_pcm(parsed_input, latents, metrics=None, deadline=None):
+    """Int16 PCM chunks for a /tts_stream request, from the audio cache when possible"""
+    gpt_cond_latent, speaker_embedding = latents
     text = parsed_input.text
     language = parsed_input.language
-
     stream_chunk_size = int(parsed_input.stream_chunk_size)
-    add_wav_header = parsed_input.add_wav_header
 
+    cache_key = None
+    if audio_cache is not None:
+        cache_key = audio_cache_key(
+            "stream",
+            text,
+            language,
+            speaker_id_for(gpt_cond_latent, speaker_embedding),
+            synthesis_params(True, stream_chunk_size),
+        )
+        pcm = audio_cache.get(cache_key)
+        if pcm is not None:
+            for start in range(0, len(pcm), CACHED_STREAM_CHUNK):
+                if metrics is not None:
+                    metrics.chunk(len(pcm[start : start + CACHED_STREAM_CHUNK]))
+                yield memoryview(pcm[start : start + CACHED_STREAM_CHUNK]).cast("B")
+            if metrics is not None:
+                metrics.finish()
+            return
 
-    chunks = model.inference_stream(
+    chunks = synthesize(
         text,
         language,
         gpt_cond_latent,
         speaker_embedding,
+        stream=True,
         stream_chunk_size=stream_chunk_size,
-        enable_text_splitting=True
+        metrics=metrics,
+        deadline=deadline,
     )
 
-    for i, chunk in enumerate(chunks):
-        chunk = postprocess(chunk)
-        if i == 0 and add_wav_header:
-            yield encode_audio_common(b"", encode_base64=False)
-            yield chunk.tobytes()
-        else:
-            yield chunk.tobytes()
+    synthesized = PcmWriter(keep=True) if cache_key is not None else None
+    try:
+        async for chunk in chunks:
+            if synthesized is not None:
+                synthesized.extend(chunk)
+            if metrics is not None:
+                metrics.chunk(len(chunk) // 2)
+            yield chunk
+    finally:
+        await chunks.aclose()
+    if metrics is not None:
+        metrics.finish()
+
+    if synthesized is not None and synthesized.length:
+        await run_in_threadpool(audio_cache.put, cache_key, synthesized.pcm())
+
+
+async def profile_generator(chunks, profile, add_wav_header):
+    """Audio converted to an output profile, yielded in whole 20 ms frames"""
+    try:
+        if add_wav_header:
+            yield profile.wav_header()
+        async for chunk in chunks:
+            data = profile.process(samples(chunk))
+            if data:
+                yield data
+        yield profile.flush()
+    finally:
+        await chunks.aclose()
+
+
+async def predict_streaming_generator(
+    parsed_input: dict = Body(...), latents=None, metrics=None, profile_id=None, deadline=None
+):
+    ACTIVE_STREAMS.inc()
+    try:
+        async for data in stream_body(parsed_input, latents, metrics, deadline):
+            yield data
+        if profile_id is not None:
+            await finish_profile(profile_id, metrics)
+    except DeadlineExceeded as e:
+        # The 200 headers are out: end the stream early instead of failing the response
+        print(f"/tts_stream ended early: {e}", flush=True)
+    finally:
+        ACTIVE_STREAMS.dec()
+        if metrics is not None and metrics.trace is not None:
+            profiles.end_trace()
+
+
+async def stream_body(parsed_input, latents, metrics=None, deadline=None):
+    chunks = stream_pcm(parsed_input, latents, metrics, deadline)
+    if parsed_input.output_profile is not None:
+        async for data in profile_generator(chunks, OutputProfile(parsed_input.output_profile), parsed_input.add_wav_header):
+            yield data
+        return
+    if parsed_input.output_format != "wav":
+        async for data in encode(chunks, parsed_input.output_format):
+            yield data
+        return
+
+    add_wav_header = parsed_input.add_wav_header
+    try:
+        i = 0
+        async for chunk in chunks:
+            # Starlette 0.27 only streams bytes, so this is the one copy of the chunk
+            if i == 0 and add_wav_header:
+                yield encode_audio_common(b"", encode_base64=False)
+                yield bytes(chunk)
+            else:
+                yield bytes(chunk)
+            i += 1
+    finally:
+        await chunks.aclose()
+
+
+def request_metrics(endpoint, parsed_input, text=None, stream=False, request=None):
+    """`RequestMetrics` for a request; unknown languages are counted as "other".
+
+    With the HTTP `request`, timing starts when it arrived, and the body
+    parsing before the endpoint ran is the `parse` stage.
+    """
+    language = parsed_input.language.split("-")[0]
+    if backend is None or language not in backend.languages:
+        language = "other"
+    text = parsed_input.text if text is None else text
+    received = received_at(request) if request is not None else None
+    return RequestMetrics(endpoint, language, len(text), stream=stream, received=received)
+
+
+def admit():
+    """Refuse new work with 429 while MAX_QUEUE_DEPTH requests are waiting for the model"""
+    if MAX_QUEUE_DEPTH > 0 and executor.depth() >= MAX_QUEUE_DEPTH:
+        raise HTTPException(
+            status_code=429, detail="The server is busy, try again later.", headers={"Retry-After": RETRY_AFTER}
+        )
+
+
+def request_deadline(parsed_input):
+    """`time.monotonic()` deadline of a request from its `timeout` (or REQUEST_TIMEOUT)"""
+    timeout = parsed_input.timeout if parsed_input.timeout is not None else REQUEST_TIMEOUT
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+def check_deadline(deadline):
+    """504 if `deadline` has passed, for endpoints that haven't started their response yet"""
+    if deadline is not None and time.monotonic() >= deadline:
+        raise HTTPException(status_code=504, detail="The request's deadline passed before synthesis started.")
+
+
+def check_profile_token(request):
+    if not profiles.authorize(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling needs the X-Profile-Token header (set PROFILE_TOKEN).")
+
+
+def start_profile(request, parsed_input, metrics):
+    """Check a profiling request and set up its trace, return its profile id (None without `profile`)"""
+    if not (parsed_input.profile or parsed_input.profile_trace):
+        return None
+    check_profile_token(request)
+    if parsed_input.profile_trace:
+        if not isinstance(executor, InferenceExecutor):
+            raise HTTPException(status_code=501, detail="Traces can't be captured with REPLICAS > 1.")
+        if not profiles.start_trace():
+            raise HTTPException(status_code=429, detail="Another request is being traced.", headers={"Retry-After": "5"})
+        metrics.trace = []
+    return profiles.new_id()
+
+
+async def finish_profile(profile_id, metrics):
+    """Store the breakdown (and trace) of a finished profiled request, return the breakdown"""
+    result = breakdown(metrics)
+    if metrics.trace is not None:
+        await run_in_threadpool(profiles.write_trace, profile_id, metrics.trace)
+        result["trace"] = f"/profiles/{profile_id}/trace"
+    profiles.put(profile_id, result)
+    return result
+
+
+def check_output_format(output_format, output_profile=None):
+    if output_profile is not None and output_format != "wav":
+        raise HTTPException(status_code=422, detail="output_profile can only be used with the wav output_format.")
+    if output_format != "wav" and FFMPEG is None:
+        raise HTTPException(status_code=501, detail=f"{output_format} output needs ffmpeg, which is not installed.")
+
+
+def streaming_media_type(parsed_input):
+    if parsed_input.output_profile is not None and not parsed_input.add_wav_header:
+        return OutputProfile(parsed_input.output_profile).media_type
+    if parsed_input.output_format != "wav":
+        return media_type(parsed_input.output_format)
+    return "audio/wav"
 
 
 @app.post("/tts_stream")
-def predict_streaming_endpoint(parsed_input: StreamingInputs):
+async def predict_streaming_endpoint(parsed_input: StreamingInputs, request: Request):
+    """With `profile`, the timing breakdown is at GET /profiles/{X-Profile-Id} once the stream has ended."""
+    deadline = request_deadline(parsed_input)
+    check_output_format(parsed_input.output_format, parsed_input.output_profile)
+    admit()
+    metrics = request_metrics("tts_stream", parsed_input, stream=True, request=request)
+    with metrics.stage("latents"):
+        latents = get_latents(parsed_input)
+    check_deadline(deadline)
+    profile_id = start_profile(request, parsed_input, metrics)
     return StreamingResponse(
-        predict_streaming_generator(parsed_input),
-        media_type="audio/wav",
+        predict_streaming_generator(parsed_input, latents, metrics, profile_id, deadline),
+        media_type=streaming_media_type(parsed_input),
+        headers={"X-Profile-Id": profile_id} if profile_id is not None else None,
     )
 
 class TTSInputs(BaseModel):
-    speaker_embedding: List[float]
-    gpt_cond_latent: List[List[float]]
+    speaker_id: Optional[str] = None
+    speaker_embedding: Optional[SpeakerEmbedding] = None
+    gpt_cond_latent: Optional[GptCondLatent] = None
     text: str
     language: str
+    output_format: OutputFormat = "wav"
+    output_profile: Optional[OutputProfileName] = None
+    profile: bool = False
+    profile_trace: bool = False
+    # Seconds after which the client no longer wants the audio
+    timeout: Optional[float] = None
 
-@app.post("/tts")
-def predict_speech(parsed_input: TTSInputs):
-    speaker_embedding = torch.tensor(parsed_input.speaker_embedding).unsqueeze(0).unsqueeze(-1)
-    gpt_cond_latent = torch.tensor(parsed_input.gpt_cond_latent).reshape((-1, 1024)).unsqueeze(0)
+
+def convert_profile(pcm, name):
+    """Whole-utterance `OutputProfile` conversion, return the WAV file bytes"""
+    profile = OutputProfile(name)
+    data = profile.process(np.asarray(pcm)) + profile.flush()
+    return profile.wav_header(len(data)) + data
+
+
+async def tts_pcm(parsed_input, latents, metrics=None, deadline=None):
+    """Int16 PCM of a whole /tts request, from the audio cache when possible"""
+    gpt_cond_latent, speaker_embedding = latents
     text = parsed_input.text
     language = parsed_input.language
 
-    out = model.inference(
+    cache_key = None
+    if audio_cache is not None:
+        cache_key = audio_cache_key(
+            "tts",
+            text,
+            language,
+            speaker_id_for(gpt_cond_latent, speaker_embedding),
+            synthesis_params(False, None),
+        )
+        pcm = audio_cache.get(cache_key)
+        if pcm is not None:
+            if metrics is not None:
+                metrics.chunk(len(pcm))
+            return pcm
+
+    writer = PcmWriter(keep=True)
+    async for chunk in synthesize(
         text,
         language,
         gpt_cond_latent,
         speaker_embedding,
+        priority=PRIORITY_BULK,
+        metrics=metrics,
+        deadline=deadline,
+    ):
+        writer.extend(chunk)
+    if metrics is not None:
+        metrics.chunk(writer.length)
+    wav = writer.pcm()
+    if cache_key is not None:
+        await run_in_threadpool(audio_cache.put, cache_key, wav)
+    return wav
+
+
+async def render_audio(wav, output_format, output_profile=None):
+    """A whole utterance as a WAV (of the output profile, if any) or compressed file"""
+    if output_profile is not None:
+        return await run_in_threadpool(convert_profile, wav, output_profile)
+    if output_format == "wav":
+        return encode_audio_common(wav.tobytes(), encode_base64=False)
+
+    async def pcm():
+        yield wav
+
+    return b"".join([data async for data in encode(pcm(), output_format)])
+
+
+@app.post("/tts")
+async def predict_speech(parsed_input: TTSInputs, request: Request):
+    """Base64 encoded WAV by default; compressed formats are returned as raw bytes.
+
+    With `profile`, the per-stage timings come back in a `Server-Timing` header.
+    """
+    deadline = request_deadline(parsed_input)
+    check_output_format(parsed_input.output_format, parsed_input.output_profile)
+    admit()
+    metrics = request_metrics("tts", parsed_input, request=request)
+    with metrics.stage("latents"):
+        latents = get_latents(parsed_input)
+    check_deadline(deadline)
+    profile_id = start_profile(request, parsed_input, metrics)
+    try:
+        try:
+            wav = await tts_pcm(parsed_input, latents, metrics, deadline)
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        with metrics.stage("encode"):
+            body = await render_audio(wav, parsed_input.output_format, parsed_input.output_profile)
+        metrics.finish()
+        headers = None
+        if profile_id is not None:
+            await finish_profile(profile_id, metrics)
+            headers = {"Server-Timing": server_timing(metrics), "X-Profile-Id": profile_id}
+    finally:
+        if metrics.trace is not None:
+            profiles.end_trace()
+    if parsed_input.output_format == "wav":
+        return JSONResponse(base64.b64encode(body).decode("utf-8"), headers=headers)
+    return Response(body, media_type=media_type(parsed_input.output_format), headers=headers)
+
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request):
+    """Timing breakdown of a profiled request"""
+    check_profile_token(request)
+    result = profiles.get(profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile {profile_id!r} (or the request is still running).")
+    return result
+
+
+@app.get("/profiles/{profile_id}/trace")
+def get_profile_trace(profile_id: str, request: Request):
+    """torch.profiler trace of a request sent with `profile_trace`, for chrome://tracing or Perfetto"""
+    check_profile_token(request)
+    result = profiles.get(profile_id)
+    if result is None or "trace" not in result:
+        raise HTTPException(status_code=404, detail=f"No trace for profile {profile_id!r}.")
+    return FileResponse(profiles.trace_path(profile_id), media_type="application/json")
+
+
+class JobInputs(BaseModel):
+    speaker_id: Optional[str] = None
+    speaker_embedding: Optional[SpeakerEmbedding] = None
+    gpt_cond_latent: Optional[GptCondLatent] = None
+    text: Optional[str] = None
+    segments: Optional[List[str]] = None
+    language: str
+    output_format: OutputFormat = "wav"
+    output_profile: Optional[OutputProfileName] = None
+
+
+# Job id -> task synthesizing its current segment, so DELETE can stop it
+job_tasks = {}
+jobs_ready = asyncio.Event()
+
+
+async def run_job_segment(job, index, text):
+    gpt_cond_latent, speaker_embedding = decoder.decode(job["gpt_cond_latent"], job["speaker_embedding"])
+    writer = PcmWriter(keep=True)
+    async for chunk in synthesize(
+        text, job["language"], gpt_cond_latent, speaker_embedding, split=True, priority=PRIORITY_BACKGROUND
+    ):
+        writer.extend(chunk)
+    body = await render_audio(writer.pcm(), job["output_format"], job["output_profile"])
+    await run_in_threadpool(jobs.write_segment, job["id"], index, job["output_format"], body)
+
+
+async def run_jobs():
+    """Synthesize queued job segments one at a time, at background priority"""
+    while True:
+        try:
+            claimed = await run_in_threadpool(jobs.claim)
+            if claimed is None:
+                jobs_ready.clear()
+                claimed = await run_in_threadpool(jobs.claim)
+        except Exception as e:
+            # E.g. a full disk or a locked database: keep the queue running and try again
+            print(f"Claiming a job segment failed: {e!r}", flush=True)
+            await asyncio.sleep(1)
+            continue
+        if claimed is None:
+            await jobs_ready.wait()
+            continue
+        job, index, text = claimed
+        task = asyncio.create_task(run_job_segment(job, index, text))
+        job_tasks[job["id"]] = task
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            # Server shutdown: the segment is queued again on the next start
+            task.cancel()
+            raise
+        finally:
+            job_tasks.pop(job["id"], None)
+        try:
+            if task.cancelled():
+                await run_in_threadpool(jobs.requeue_segment, job["id"], index)
+            elif task.exception() is not None:
+                print(f"Job {job['id']} segment {index} failed: {task.exception()!r}", flush=True)
+                await run_in_threadpool(jobs.finish_segment, job["id"], index, str(task.exception()))
+        except Exception as e:
+            print(f"Job {job['id']} segment {index}: recording its result failed: {e!r}", flush=True)
+
+
+def get_jobs():
+    if jobs is None:
+        raise HTTPException(status_code=503, detail="The job API is disabled, set JOBS_DIR to enable it.")
+    return jobs
+
+
+def get_job(job_id):
+    job = get_jobs().job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id!r}.")
+    return job
+
+
+def job_status(job):
+    """Job progress, with the status of every segment"""
+    segments = jobs.segments(job["id"])
+    counts = collections.Counter(segment["status"] for segment in segments)
+    if job["cancelled"]:
+        status = "cancelled"
+    elif counts["pending"] + counts["running"] == 0:
+        status = "done"
+    elif counts["pending"] == len(segments):
+        status = "queued"
+    else:
+        status = "running"
+    return {
+        "job_id": job["id"],
+        "status": status,
+        "created": job["created"],
+        "segments_total": len(segments),
+        "segments_done": counts["done"],
+        "segments_failed": counts["failed"],
+        "segments": [
+            {"index": segment["idx"], "status": segment["status"], **({"error": segment["error"]} if segment["error"] else {})}
+            for segment in segments
+        ],
+    }
+
+
+@app.post("/jobs")
+async def create_job(parsed_input: JobInputs):
+    """Queue a long text for synthesis; poll GET /jobs/{job_id} and download segments as they finish."""
+    store = get_jobs()
+    check_output_format(parsed_input.output_format, parsed_input.output_profile)
+    if (parsed_input.text is None) == (parsed_input.segments is None):
+        raise HTTPException(status_code=422, detail="Exactly one of text and segments is required.")
+    if parsed_input.language.split("-")[0] not in backend.char_limits:
+        raise HTTPException(status_code=422, detail=f"Unsupported language {parsed_input.language!r}.")
+    gpt_cond_latent, speaker_embedding = get_latents(parsed_input)
+
+    segments = parsed_input.segments
+    if segments is None:
+        sentences = await run_in_threadpool(backend.split, parsed_input.text, parsed_input.language)
+        segments = pack_segments(sentences, JOB_SEGMENT_CHARS)
+    segments = [segment.strip() for segment in segments if segment.strip()]
+    if not segments:
+        raise HTTPException(status_code=422, detail="The job has no text to synthesize.")
+
+    job_id = await run_in_threadpool(
+        store.create,
+        segments,
+        parsed_input.language,
+        parsed_input.output_format,
+        parsed_input.output_profile,
+        to_fp16_bytes(gpt_cond_latent),
+        to_fp16_bytes(speaker_embedding),
     )
+    jobs_ready.set()
+    return job_status(store.job(job_id))
 
-    wav = postprocess(torch.tensor(out["wav"]))
 
-    return encode_audio_common(wav.tobytes())
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    return job_status(get_job(job_id))
 
 
-@app.get("/studio_speakers")
-def get_speakers():
-    if hasattr(model, "speaker_manager") and hasattr(model.speaker_manager, "speakers"):
-        return {
-            speaker: {
-                "speaker_embedding": model.speaker_manager.speakers[speaker]["speaker_embedding"].cpu().squeeze().half().tolist(),
-                "gpt_cond_latent": model.speaker_manager.speakers[speaker]["gpt_cond_latent"].cpu().squeeze().half().tolist(),
+@app.get("/jobs/{job_id}/segments/{index}")
+def get_job_segment(job_id: str, index: int):
+    """Audio of a finished segment (WAV, or the job's compressed output format)"""
+    job = get_job(job_id)
+    segments = jobs.segments(job_id)
+    if not 0 <= index < len(segments):
+        raise HTTPException(status_code=404, detail=f"Job {job_id!r} has no segment {index}.")
+    if segments[index]["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Segment {index} is {segments[index]['status']}.")
+    return FileResponse(
+        jobs.segment_path(job_id, index, job["output_format"]),
+        media_type="audio/wav" if job["output_format"] == "wav" else media_type(job["output_format"]),
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job; segments that are already done stay available."""
+    get_job(job_id)
+    await run_in_threadpool(jobs.cancel, job_id)
+    task = job_tasks.get(job_id)
+    if task is not None:
+        task.cancel()
+    return job_status(jobs.job(job_id))
+
+
+class WebSocketInputs(BaseModel):
+    speaker_id: Optional[str] = None
+    speaker_embedding: Optional[SpeakerEmbedding] = None
+    gpt_cond_latent: Optional[GptCondLatent] = None
+    language: str
+    stream_chunk_size: str = "20"
+    profile: bool = False
+    # Seconds each segment may take, from when it is cut from the text
+    timeout: Optional[float] = None
+
+
+@app.websocket("/tts_ws")
+async def predict_websocket(websocket: WebSocket):
+    """Synthesize text that arrives in fragments.
+
+    The first message sets up the speaker and language (like a /tts_stream
+    body without `text`). After that the client sends `{"text": ...}`
+    fragments, `{"flush": true}` to synthesize what is buffered,
+    `{"cancel": true}` to drop buffered text and stop the audio in progress,
+    and `{"close": true}` to finish. Audio comes back as binary frames of raw
+    24 kHz int16 PCM, with a `{"event": "segment", "text": ...}` message
+    after each segment (and a `{"event": "profile", ...}` timing breakdown
+    when the setup message has `profile`).
+    """
+    await websocket.accept()
+    if not ready:
+        await websocket.send_json({"event": "error", "detail": "The model is still loading."})
+        await websocket.close(code=1013)
+        return
+    try:
+        admit()
+    except HTTPException as e:
+        await websocket.send_json({"event": "error", "detail": e.detail})
+        await websocket.close(code=1013)
+        return
+    try:
+        parsed_input = WebSocketInputs.parse_obj(await websocket.receive_json())
+        if parsed_input.profile:
+            check_profile_token(websocket)
+        gpt_cond_latent, speaker_embedding = get_latents(parsed_input)
+        language = parsed_input.language.split("-")[0]
+        segmenter = TextSegmenter(backend.char_limits.get(language, 250))
+    except (ValidationError, HTTPException, ValueError) as e:
+        await websocket.send_json({"event": "error", "detail": str(getattr(e, "detail", e))})
+        await websocket.close(code=1008)
+        return
+
+    # (segment, metrics, audio) in the order the segments were cut
+    segments = asyncio.Queue()
+    # Syntheses started ahead of the segment being sent
+    running = set()
+    ACTIVE_STREAMS.inc()
+
+    def start(segment):
+        """Start synthesizing `segment` right away; its audio waits in a queue until `speak` sends it"""
+        metrics = request_metrics("tts_ws", parsed_input, text=segment, stream=True)
+        deadline = request_deadline(parsed_input)
+        audio = asyncio.Queue()
+
+        async def run():
+            try:
+                async for chunk in synthesize(
+                    segment,
+                    parsed_input.language,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    stream=True,
+                    stream_chunk_size=int(parsed_input.stream_chunk_size),
+                    metrics=metrics,
+                    deadline=deadline,
+                ):
+                    metrics.chunk(len(chunk) // 2)
+                    # Chunks are only valid until the next one, so keep a copy
+                    audio.put_nowait(bytes(chunk))
+            except DeadlineExceeded as e:
+                # The segment ends with an error event, the socket stays open
+                print(f"/tts_ws segment ended early: {e}", flush=True)
+                audio.put_nowait(e)
+                return
+            except Exception as e:
+                audio.put_nowait(e)
+                return
+            audio.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        running.add(task)
+        task.add_done_callback(running.discard)
+        segments.put_nowait((segment, metrics, audio))
+
+    def stop():
+        for task in list(running):
+            task.cancel()
+
+    async def speak():
+        while True:
+            item = await segments.get()
+            if item is None:
+                return
+            segment, metrics, audio = item
+            while True:
+                chunk = await audio.get()
+                if not isinstance(chunk, bytes):
+                    break
+                await websocket.send_bytes(chunk)
+            if chunk is not None:
+                await websocket.send_json({"event": "error", "text": segment, "detail": str(chunk)})
+                continue
+            metrics.finish()
+            await websocket.send_json({"event": "segment", "text": segment})
+            if parsed_input.profile:
+                await websocket.send_json({"event": "profile", "text": segment, **breakdown(metrics)})
+
+    speaker = asyncio.create_task(speak())
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if "text" in message:
+                for segment in segmenter.push(message["text"]):
+                    start(segment)
+            if message.get("cancel"):
+                segmenter.clear()
+                stop()
+                speaker.cancel()
+                segments = asyncio.Queue()
+                speaker = asyncio.create_task(speak())
+                await websocket.send_json({"event": "cancelled"})
+            if message.get("flush") or message.get("close"):
+                segment = segmenter.flush()
+                if segment:
+                    start(segment)
+            if message.get("close"):
+                segments.put_nowait(None)
+                await speaker
+                await websocket.send_json({"event": "done"})
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        await websocket.send_json({"event": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+    finally:
+        stop()
+        speaker.cancel()
+        ACTIVE_STREAMS.dec()
+
+
+studio_speaker_bodies = {}
+
+
+def studio_speakers_body(encoding):
+    """Serialized /studio_speakers body for `encoding` ("compact" for ids only), built once"""
+    if encoding not in studio_speaker_bodies:
+        if encoding == "compact":
+            payload = {speaker: {"speaker_id": speaker} for speaker in studio_speakers}
+            body, media_type = serialize_latents(payload, "json")
+        else:
+            payload = {
+                speaker: {"speaker_id": speaker, **encode_speaker(gpt_cond_latent, speaker_embedding, encoding)}
+                for speaker, (gpt_cond_latent, speaker_embedding) in studio_speakers.items()
             }
-            for speaker in model.speaker_manager.speakers.keys()
-        }
-    else:
-        return {}
-        
+            body, media_type = serialize_latents(payload, encoding, npz_speakers=studio_speakers)
+        studio_speaker_bodies[encoding] = CachedBody(body, media_type)
+    return studio_speaker_bodies[encoding]
+
+
+
+@app.get("/studio_speakers")
+def get_speakers(request: Request, encoding: Optional[str] = None, compact: bool = False):
+    encoding = "compact" if compact else get_encoding(request, encoding)
+    return studio_speakers_body(encoding).response(request)
+
+
+@app.get("/audio_cache")
+def get_audio_cache_stats():
+    """Hit/miss counters and size of the synthesized audio cache"""
+    if audio_cache is None:
+        return {"enabled": False}
+    stats = {"enabled": True, **audio_cache.stats()}
+    if sentence_cache is not None:
+        stats["sentences"] = sentence_cache.stats()
+    return stats
+
+
 @app.get("/languages")
 def get_languages():
-    return config.languages
\ No newline at end of file
+    return backend.languages
\ No newline at end of file
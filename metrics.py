@@ -0,0 +1,107 @@
+import collections
+import contextlib
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+SAMPLE_RATE = 24000
+
+TIME_TO_FIRST_CHUNK = Histogram(
+    "xtts_time_to_first_chunk_seconds",
+    "Time from the request's arrival to its first audio chunk (streaming endpoints)",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10),
+)
+REQUEST_SECONDS = Histogram(
+    "xtts_request_duration_seconds",
+    "Time from the request's arrival to its last audio chunk",
+    ["endpoint"],
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120),
+)
+REAL_TIME_FACTOR = Histogram(
+    "xtts_real_time_factor",
+    "Request duration divided by the duration of the audio it produced",
+    ["endpoint"],
+    buckets=(0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5),
+)
+# Stages: parse (reading and validating the body before the endpoint runs,
+# see `RequestMetrics`), latents (building tensors from inline latents or
+# looking up a speaker), gpt, vocoder, postprocess (model output to int16
+# PCM) and encode (WAV or compressed file, /tts only)
+STAGE_SECONDS = Histogram(
+    "xtts_stage_duration_seconds",
+    "Time spent on a request per stage (batched GPT decoding counts for every request in the batch)",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+QUEUE_DEPTH = Gauge("xtts_queue_depth", "Synthesis requests waiting for the model")
+ACTIVE_STREAMS = Gauge("xtts_active_streams", "Open /tts_stream responses and /tts_ws connections")
+LOADED_SPEAKERS = Gauge("xtts_loaded_speakers", "Speakers held in the speaker registry")
+CHARACTERS = Counter("xtts_characters_total", "Characters of text synthesized", ["language"])
+AUDIO_SECONDS = Counter("xtts_audio_seconds_total", "Seconds of audio synthesized", ["language"])
+
+
+def metrics_body():
+    """The /metrics response body and its media type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class RequestMetrics:
+    """Timings of one synthesis request, observed into the metrics when it finishes.
+
+    Only a few clock reads and additions happen while the request runs; the
+    histograms are updated once, by `finish`. Requests that fail or are
+    abandoned are never finished, so they don't skew the latencies.
+    """
+
+    def __init__(self, endpoint, language, characters, stream=False, received=None):
+        self.endpoint = endpoint
+        self.language = language
+        self.characters = characters
+        self.stream = stream
+        self.start = time.perf_counter()
+        self.first_chunk = None
+        self.samples = 0
+        self.stages = collections.defaultdict(float)
+        if received is not None:
+            # Reading, parsing and validating the body ran before the endpoint
+            self.stages["parse"] = self.start - received
+            self.start = received
+        self.total = None
+        # Chrome trace events, collected when the request is traced (see profiling.py)
+        self.trace = None
+
+    def chunk(self, samples):
+        """Count `samples` of 24 kHz audio produced"""
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter() - self.start
+        self.samples += samples
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def update(self, timings):
+        """Add the stage timings the scheduler recorded on a `SynthesisRequest`"""
+        for stage, seconds in timings.items():
+            self.stages[stage] += seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def finish(self):
+        self.total = total = time.perf_counter() - self.start
+        audio_seconds = self.samples / SAMPLE_RATE
+        REQUEST_SECONDS.labels(self.endpoint).observe(total)
+        if self.stream and self.first_chunk is not None:
+            TIME_TO_FIRST_CHUNK.labels(self.endpoint).observe(self.first_chunk)
+        if audio_seconds:
+            REAL_TIME_FACTOR.labels(self.endpoint).observe(total / audio_seconds)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        CHARACTERS.labels(self.language).inc(self.characters)
+        AUDIO_SECONDS.labels(self.language).inc(audio_seconds)
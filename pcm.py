@@ -0,0 +1,79 @@
+import numpy as np
+import torch
+
+
+def postprocess(wav):
+    """Post process the output waveform"""
+    if isinstance(wav, list):
+        wav = torch.cat(wav, dim=0)
+    wav = wav.clone().detach().cpu().numpy()
+    wav = wav[None, : int(wav.shape[0])]
+    wav = np.clip(wav, -1, 1)
+    wav = (wav * 32767).astype(np.int16)
+    return wav
+
+
+def samples(chunk):
+    """Int16 samples of a PCM chunk (bytes, memoryview or array), without copying"""
+    return np.frombuffer(chunk, dtype=np.int16)
+
+
+class PcmWriter:
+    """Turn model output into int16 PCM using buffers that live as long as the stream.
+
+    Same result as `postprocess`, but each chunk costs one device-to-host copy
+    into a float32 staging buffer (pinned when the model runs on CUDA), where
+    it is clipped and scaled in place and then quantized into the int16
+    buffer. `write` returns a byte memoryview of the chunk. With
+    `keep=False` it is only valid until the next write; with `keep=True`
+    chunks are appended instead, so earlier views stay valid and `pcm()` is
+    the whole stream without a final concatenation.
+    """
+
+    def __init__(self, keep=False, capacity=24000):
+        self.keep = keep
+        self.length = 0
+        self._staging = None
+        self._pcm = np.empty(capacity, dtype=np.int16)
+
+    def _reserve(self, n):
+        """Int16 buffer for the next `n` samples, growing (by doubling) if needed"""
+        offset = self.length if self.keep else 0
+        if offset + n > len(self._pcm):
+            grown = np.empty(max(offset + n, 2 * len(self._pcm)), dtype=np.int16)
+            grown[:offset] = self._pcm[:offset]
+            # Views handed out earlier keep the old buffer alive
+            self._pcm = grown
+        self.length = offset + n
+        return self._pcm[offset : offset + n]
+
+    def _staging_for(self, wav, n):
+        pin = wav.is_cuda
+        if self._staging is None or self._staging.numel() < n or self._staging.is_pinned() != pin:
+            size = max(n, 2 * self._staging.numel()) if self._staging is not None else n
+            self._staging = torch.empty(size, dtype=torch.float32, pin_memory=pin)
+        return self._staging[:n]
+
+    def write(self, wav):
+        """Convert a float waveform (tensor or list of tensors), return its PCM as a byte memoryview"""
+        if isinstance(wav, list):
+            wav = torch.cat(wav, dim=0)
+        wav = wav.detach().reshape(-1)
+        staging = self._staging_for(wav, wav.numel())
+        staging.copy_(wav)
+        values = staging.numpy()
+        np.clip(values, -1, 1, out=values)
+        values *= 32767
+        out = self._reserve(len(values))
+        # Unsafe casting truncates like astype(np.int16)
+        np.copyto(out, values, casting="unsafe")
+        return memoryview(out).cast("B")
+
+    def extend(self, chunk):
+        """Append already converted PCM (only meaningful with `keep=True`)"""
+        data = samples(chunk)
+        self._reserve(len(data))[:] = data
+
+    def pcm(self):
+        """Int16 samples written so far (the last chunk only, unless `keep=True`)"""
+        return self._pcm[: self.length]
@@ -1,5 +1,6 @@
 import gradio as gr
 import requests
+import time
 import base64
 import tempfile
 import json
@@ -29,6 +30,9 @@ elif os.path.exists(os.path.join(OUTPUT, "cloned_speakers")):
 
 try:
     print("Getting metadata from server ...")
+    # The server answers 503 until the model is loaded
+    while requests.get(SERVER_URL + "/ready").status_code == 503:
+        time.sleep(2)
     LANUGAGES = requests.get(SERVER_URL + "/languages").json()
     print("Available languages:", ", ".join(LANUGAGES))
     STUDIO_SPEAKERS = requests.get(SERVER_URL + "/studio_speakers").json()
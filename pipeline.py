@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+
+import torch
+
+
+class VocoderStage:
+    """Vocode on a thread of its own so the GPT can decode the next chunk or sentence meanwhile.
+
+    The scheduler hands over `vocode()` callables together with the request
+    whose audio they produce; they run in order on the vocoder thread, and
+    the request's `finish` is queued behind them so it never overtakes its
+    audio. At most `depth` vocode jobs wait at a time: when the vocoder
+    falls behind, the decoder blocks instead of buffering latents without
+    bound. With `depth=0` every job runs inline on the calling thread.
+
+    The thread is started on first use in each process, so a stage created
+    before `ReplicaPool` forks also works in the replicas. It runs with the
+    intra-op threads of the thread that started it, or, after `pin`, on its
+    own cores (so it doesn't compete with `CorePool` lanes).
+    """
+
+    def __init__(self, depth=0):
+        self.depth = depth
+        # Cores reserved for the vocoder thread (None: the process's affinity)
+        self.cores = None
+        # id(request) -> error of a vocode job, reported when the request finishes
+        self.failed = {}
+        self._jobs = None
+        self._slots = None
+        self._pid = None
+
+    def _submit(self, job, vocode):
+        if self.depth <= 0:
+            job()
+            return
+        if self._pid != os.getpid():
+            self._jobs = queue.Queue()
+            self._slots = threading.Semaphore(self.depth)
+            self._pid = os.getpid()
+            threading.Thread(
+                target=self._run,
+                args=(self._jobs, torch.get_num_threads(), self.cores),
+                name="xtts-vocoder",
+                daemon=True,
+            ).start()
+        if vocode:
+            self._slots.acquire()
+        self._jobs.put((job, vocode))
+
+    def pin(self, cores):
+        """Run the vocoder thread on `cores` only, with as many intra-op threads (before its first job)"""
+        self.cores = set(cores)
+
+    def _run(self, jobs, num_threads, cores):
+        if cores:
+            os.sched_setaffinity(0, cores)
+            num_threads = len(cores)
+        torch.set_num_threads(num_threads)
+        while True:
+            job, vocode = jobs.get()
+            try:
+                with torch.inference_mode():
+                    job()
+            finally:
+                if vocode:
+                    self._slots.release()
+                jobs.task_done()
+
+    def vocode(self, request, vocode):
+        """Run `vocode()` and emit the wav it returns to `request`"""
+
+        def job():
+            if id(request) in self.failed:
+                return
+            try:
+                wav = vocode()
+            except Exception as e:
+                self.failed[id(request)] = e
+                request.cancelled = True
+                return
+            request.emit(wav)
+
+        self._submit(job, vocode=True)
+
+    def finish(self, request, error=None):
+        """Finish `request` once its queued audio is out (with the error of a failed vocode job, if any)"""
+
+        def job():
+            request.finish(self.failed.pop(id(request), error))
+
+        self._submit(job, vocode=False)
+
+    def wait(self):
+        """Block until every queued job has run"""
+        if self.depth > 0 and self._pid == os.getpid():
+            self._jobs.join()
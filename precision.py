@@ -0,0 +1,92 @@
+import torch
+from torch import nn
+
+# PRECISION covers the GPT; the vocoder is convolutional, so int8 dynamic
+# quantization (Linear/LSTM only) doesn't apply to it.
+GPT_PRECISIONS = ("fp32", "bf16", "int8")
+VOCODER_PRECISIONS = ("fp32", "bf16")
+
+
+def bf16_supported():
+    """Whether oneDNN has fast bf16 kernels on this CPU (AVX512-BF16 or AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def to_float(output, keep=("past_key_values",)):
+    """Cast floating point outputs back to float32 (tensors, tuples and HF ModelOutputs)"""
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, dict):
+        for key in list(output.keys()):
+            if key not in keep:
+                output[key] = to_float(output[key])
+        return output
+    if isinstance(output, tuple):
+        return tuple(to_float(item) for item in output)
+    return output
+
+
+class Autocast(nn.Module):
+    """Run a module under CPU bf16 autocast and hand float32 outputs to the fp32 code around it.
+
+    The KV cache is left in bf16, since it only ever goes back into the
+    wrapped module.
+    """
+
+    def __init__(self, module, dtype=torch.bfloat16):
+        super().__init__()
+        self.module = module
+        self.dtype = dtype
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast("cpu", dtype=self.dtype):
+            output = self.module(*args, **kwargs)
+        return to_float(output)
+
+
+def conv1d_to_linear(module):
+    """Swap the HF GPT-2 `Conv1D` layers (x @ W + b) for equivalent `nn.Linear` so they can be quantized"""
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+
+
+def apply_precision(model, gpt_precision="fp32", vocoder_precision="fp32"):
+    """Switch the GPT decoder and the vocoder of a CPU model to reduced precision, in place.
+
+    int8 quantizes the linear layers of the GPT transformer and its audio
+    head dynamically (weights int8, activations quantized on the fly). bf16
+    runs the GPT decode step or the vocoder under autocast, and falls back to
+    fp32 where the CPU has no bf16 support. The conditioning encoder used for
+    cloning is left alone. Returns the precisions actually applied.
+    """
+    if gpt_precision not in GPT_PRECISIONS:
+        raise ValueError(f"Unsupported PRECISION {gpt_precision!r}, use one of {', '.join(GPT_PRECISIONS)}.")
+    if vocoder_precision not in VOCODER_PRECISIONS:
+        raise ValueError(f"Unsupported VOCODER_PRECISION {vocoder_precision!r}, use one of {', '.join(VOCODER_PRECISIONS)}.")
+    if "bf16" in (gpt_precision, vocoder_precision) and not bf16_supported():
+        print("This CPU has no bf16 support, using fp32 instead", flush=True)
+        gpt_precision = "fp32" if gpt_precision == "bf16" else gpt_precision
+        vocoder_precision = "fp32"
+
+    gpt = model.gpt
+    if gpt_precision == "int8":
+        conv1d_to_linear(gpt.gpt)
+        torch.ao.quantization.quantize_dynamic(gpt.gpt, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        torch.ao.quantization.quantize_dynamic(gpt.gpt_inference.lm_head, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif gpt_precision == "bf16":
+        gpt.gpt_inference.transformer = Autocast(gpt.gpt_inference.transformer)
+    if vocoder_precision == "bf16":
+        model.hifigan_decoder.waveform_decoder = Autocast(model.hifigan_decoder.waveform_decoder)
+    return gpt_precision, vocoder_precision
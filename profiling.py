@@ -0,0 +1,108 @@
+import collections
+import contextlib
+import hmac
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import torch
+
+
+@contextlib.contextmanager
+def trace_round(requests):
+    """Run one batch round under `torch.profiler` if any of `requests` wants a trace.
+
+    The profiler only sees the thread it runs on, so it is started on the
+    inference thread for each round the request takes part in; the Chrome
+    trace events of every round are appended to the request's `trace` list.
+    Other requests batched with it show up in the trace too.
+    """
+    if not requests:
+        yield
+        return
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+        yield
+    with tempfile.NamedTemporaryFile(suffix=".json") as file:
+        prof.export_chrome_trace(file.name)
+        events = json.load(file)["traceEvents"]
+    for request in requests:
+        request.trace.extend(events)
+
+
+def server_timing(metrics):
+    """`Server-Timing` header value of a finished `RequestMetrics`"""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in metrics.stages.items()]
+    parts.append(f"total;dur={metrics.total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def breakdown(metrics):
+    """Per-stage timings of a finished `RequestMetrics`, in milliseconds"""
+    result = {
+        "total_ms": round(metrics.total * 1000, 1),
+        "audio_seconds": round(metrics.samples / 24000, 3),
+        "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in metrics.stages.items()},
+    }
+    if metrics.stream and metrics.first_chunk is not None:
+        result["time_to_first_chunk_ms"] = round(metrics.first_chunk * 1000, 1)
+    return result
+
+
+class ProfileStore:
+    """Results of the last `keep` profiled requests, and their traces on disk.
+
+    Profiling is off unless a token is configured, and every profiling
+    request has to present it. Only one trace is captured at a time, since
+    the profiler slows down every request batched with the traced one; a
+    trace that was never ended (e.g. a stream nobody read) stops blocking
+    others after `trace_timeout` seconds.
+    """
+
+    def __init__(self, token, directory, keep=20, trace_timeout=300):
+        self.token = token
+        self.directory = directory
+        self.keep = keep
+        self.trace_timeout = trace_timeout
+        self.results = collections.OrderedDict()
+        self._tracing_since = None
+
+    def authorize(self, token):
+        return self.token is not None and token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def start_trace(self):
+        """Claim the trace slot, return False if another request holds it"""
+        now = time.monotonic()
+        if self._tracing_since is not None and now - self._tracing_since < self.trace_timeout:
+            return False
+        self._tracing_since = now
+        return True
+
+    def end_trace(self):
+        self._tracing_since = None
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def trace_path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def write_trace(self, profile_id, events):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.trace_path(profile_id), "w") as file:
+            json.dump({"traceEvents": events}, file)
+
+    def put(self, profile_id, result):
+        self.results[profile_id] = result
+        while len(self.results) > self.keep:
+            old_id, old = self.results.popitem(last=False)
+            if "trace" in old:
+                with contextlib.suppress(OSError):
+                    os.remove(self.trace_path(old_id))
+
+    def get(self, profile_id):
+        return self.results.get(profile_id)
@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from starlette.concurrency import run_in_threadpool
+
+from batching import ScheduledRequest
+
+
+def parse_cpus(spec, replicas):
+    """CPU sets per replica from `REPLICA_CPUS`.
+
+    "auto" splits the cores this process may run on into `replicas`
+    contiguous groups, "none" disables pinning, anything else lists one set
+    per replica, e.g. "0-3;4-7" or "0,2;1,3".
+    """
+    if spec == "none":
+        return [None] * replicas
+    if spec == "auto":
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) < replicas:
+            return [None] * replicas
+        size, extra = divmod(len(cores), replicas)
+        sets, start = [], 0
+        for i in range(replicas):
+            end = start + size + (1 if i < extra else 0)
+            sets.append(set(cores[start:end]))
+            start = end
+        return sets
+    sets = []
+    for group in spec.split(";"):
+        cpus = set()
+        for part in group.split(","):
+            first, _, last = part.strip().partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+        sets.append(cpus)
+    if len(sets) != replicas:
+        raise ValueError(f"REPLICA_CPUS lists {len(sets)} CPU sets for {replicas} replicas.")
+    return sets
+
+
+class ReplicaRequest(ScheduledRequest):
+    """The parts of a `SynthesisRequest` the scheduler needs, inside a replica process"""
+
+    def __init__(
+        self,
+        request_id,
+        results,
+        registry,
+        segments,
+        gpt_cond_latent,
+        speaker_embedding,
+        stream,
+        stream_chunk_size,
+        priority,
+        deadline,
+        submitted,
+    ):
+        # deadline and submitted are time.monotonic(), which is shared by every
+        # process on the machine; traces are only captured by the in-process executor
+        super().__init__(
+            [torch.from_numpy(tokens) for tokens in segments],
+            torch.from_numpy(gpt_cond_latent),
+            torch.from_numpy(speaker_embedding),
+            stream=stream,
+            stream_chunk_size=stream_chunk_size,
+            priority=priority,
+            deadline=deadline,
+            submitted=submitted,
+        )
+        self.request_id = request_id
+        self.results = results
+        self.registry = registry
+
+    def emit(self, wav):
+        self.results.put(("chunk", self.request_id, wav.detach().cpu().numpy()))
+
+    def finish(self, error=None):
+        if error is not None and not isinstance(error, (AssertionError, RuntimeError, ValueError)):
+            # Only send exceptions that are sure to pickle
+            error = RuntimeError(repr(error))
+        self.registry.pop(self.request_id, None)
+        self.results.put(("done", self.request_id, (error, dict(self.timings))))
+
+
+def run_replica(backend, scheduler, inbox, results, num_threads, cpus):
+    """Main loop of a replica process: the synchronous twin of `InferenceExecutor._run`"""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    requests = {}
+    pending = collections.deque()
+
+    def receive(message):
+        if message is None:
+            return False
+        if message[0] == "submit":
+            _, request_id, fields = message
+            request = ReplicaRequest(request_id, results, requests, **fields)
+            requests[request_id] = request
+            pending.append(request)
+        elif message[0] == "cancel" and message[1] in requests:
+            requests[message[1]].cancelled = True
+        return True
+
+    while True:
+        deadline = None
+        if not pending:
+            if not receive(inbox.get()):
+                return
+            deadline = time.monotonic() + scheduler.max_wait
+        # Wait out the batch window when idle, then take everything queued so
+        # `next_batch` sees newcomers even while `pending` is full
+        while deadline is not None and len(pending) < scheduler.max_batch_size:
+            try:
+                message = inbox.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if not receive(message):
+                return
+        while True:
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                break
+            if not receive(message):
+                return
+        if pending:
+            batch = scheduler.next_batch(pending)
+            if batch:
+                pending.extend(scheduler.run_batch(batch))
+
+
+class ReplicaPool:
+    """Drop-in for `InferenceExecutor` that runs synthesis on several CPU processes.
+
+    The model is loaded once; `start` forks the replicas afterwards, so they
+    share its weights copy-on-write (inference never writes to them) instead
+    of each holding a copy. Every replica batches its own requests with the
+    scheduler, using `num_threads` intra-op threads pinned to its own CPU set.
+    Requests are tokenized here and sent to the replica with the fewest
+    sentences in flight; audio comes back through a shared result queue.
+    `call` (speaker cloning) still runs on a thread of this process.
+    """
+
+    def __init__(self, backend, scheduler, replicas, num_threads, cpus=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.replicas = replicas
+        self.num_threads = num_threads
+        self.cpus = cpus or [None] * replicas
+        self.processes = []
+        self.inboxes = []
+        self.results = None
+        self._load = [0] * replicas
+        self._requests = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="xtts-inference")
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+        self.results = context.Queue()
+        for i in range(self.replicas):
+            inbox = context.Queue()
+            process = context.Process(
+                target=run_replica,
+                args=(self.backend, self.scheduler, inbox, self.results, self.num_threads, self.cpus[i]),
+                name=f"xtts-replica-{i}",
+                daemon=True,
+            )
+            process.start()
+            print(f"Started inference replica {i} (pid {process.pid}, cpus {sorted(self.cpus[i] or [])})", flush=True)
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        threading.Thread(target=self._read_results, name="xtts-replica-results", daemon=True).start()
+
+    async def stop(self):
+        self._stopped.set()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            await run_in_threadpool(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        self._thread.shutdown(wait=False)
+
+    async def submit(self, request):
+        """Tokenize `request` off the event loop and send it to the least loaded replica"""
+        await run_in_threadpool(request.tokenize, self.backend)
+        with self._lock:
+            alive = [i for i, process in enumerate(self.processes) if process.is_alive()]
+            if not alive:
+                raise RuntimeError("No inference replica is running.")
+            index = min(alive, key=lambda i: self._load[i])
+            request_id = next(self._ids)
+            weight = len(request.segments)
+            self._requests[request_id] = (index, request, weight)
+            self._load[index] += weight
+        request.on_cancel = functools.partial(self.inboxes[index].put, ("cancel", request_id))
+        fields = {
+            "segments": [tokens.numpy() for tokens in request.segments],
+            "gpt_cond_latent": request.gpt_cond_latent.detach().cpu().numpy(),
+            "speaker_embedding": request.speaker_embedding.detach().cpu().numpy(),
+            "stream": request.stream,
+            "stream_chunk_size": request.stream_chunk_size,
+            "priority": request.priority,
+            "deadline": request.deadline,
+            "submitted": request.submitted,
+        }
+        self.inboxes[index].put(("submit", request_id, fields))
+        return request
+
+    def depth(self):
+        """Requests in flight on the replicas (their queues aren't visible from here)"""
+        return len(self._requests)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run `fn` on this process's model thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread, functools.partial(fn, *args, **kwargs))
+
+    def _finish(self, request_id, error=None, timings=None):
+        with self._lock:
+            entry = self._requests.pop(request_id, None)
+            if entry is None:
+                return
+            index, request, weight = entry
+            self._load[index] -= weight
+        for stage, seconds in (timings or {}).items():
+            request.timings[stage] += seconds
+        request.finish(error)
+
+    def _check_replicas(self):
+        """Fail the requests of replicas that died"""
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            with self._lock:
+                lost = [request_id for request_id, entry in self._requests.items() if entry[0] == index]
+            for request_id in lost:
+                self._finish(request_id, RuntimeError(f"Inference replica {index} exited with code {process.exitcode}."))
+
+    def _read_results(self):
+        checked = time.monotonic()
+        while not self._stopped.is_set():
+            if time.monotonic() - checked > 1:
+                self._check_replicas()
+                checked = time.monotonic()
+            try:
+                kind, request_id, payload = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            if kind == "done":
+                self._finish(request_id, *payload)
+                continue
+            with self._lock:
+                entry = self._requests.get(request_id)
+            if entry is not None:
+                entry[1].emit(torch.from_numpy(payload))
@@ -0,0 +1,50 @@
+import gzip
+import hashlib
+
+from fastapi.responses import JSONResponse, Response
+
+
+class CachedBody:
+    """A response body serialized once and served from memory.
+
+    Carries a strong ETag so clients revalidating with `If-None-Match` get an
+    empty 304, and keeps a gzipped copy for clients that accept it.
+    """
+
+    def __init__(self, body, media_type="application/json"):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.gzipped = gzip.compress(body, compresslevel=6)
+
+    def response(self, request):
+        headers = {"ETag": self.etag, "Vary": "Accept, Accept-Encoding", "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        if "gzip" in request.headers.get("accept-encoding", "").lower() and len(self.gzipped) < len(self.body):
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type=self.media_type, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+class ReadinessGate:
+    """ASGI middleware answering 503 (with Retry-After) until `is_ready()`.
+
+    Paths in `paths` (health checks, docs) are always served. A plain ASGI
+    middleware rather than `@app.middleware`, so streamed responses don't
+    pass through an extra memory stream.
+    """
+
+    def __init__(self, app, is_ready, paths, detail):
+        self.app = app
+        self.is_ready = is_ready
+        self.paths = paths
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.paths and not self.is_ready():
+            response = JSONResponse(self.detail(), status_code=503, headers={"Retry-After": "5"})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -0,0 +1,53 @@
+import re
+
+# Sentence end: terminal punctuation (plus closing quotes/brackets) followed by
+# whitespace, so "3.14" or a fragment still being typed isn't cut.
+SENTENCE_END = re.compile(r"[.!?…。！？]+[\"'”’)\]]*\s")
+CLAUSE_END = re.compile(r"[,;:—–]\s")
+
+
+class TextSegmenter:
+    """Buffer streamed text (e.g. LLM tokens) and cut it into segments to synthesize.
+
+    A segment ends at a sentence boundary, at a clause boundary once at least
+    `min_clause_chars` are buffered, or at the last space before `max_chars`
+    so no segment outgrows what the model can say in one go.
+    """
+
+    def __init__(self, max_chars, min_clause_chars=40):
+        self.max_chars = max_chars
+        self.min_clause_chars = min_clause_chars
+        self.buffer = ""
+
+    def _boundary(self):
+        match = SENTENCE_END.search(self.buffer)
+        if match:
+            return match.end()
+        if len(self.buffer) >= self.min_clause_chars:
+            clauses = [m.end() for m in CLAUSE_END.finditer(self.buffer) if m.end() >= self.min_clause_chars]
+            if clauses:
+                return clauses[0]
+        if len(self.buffer) > self.max_chars:
+            space = self.buffer.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+    def push(self, text):
+        """Add a text fragment and return the segments it completed"""
+        self.buffer += text
+        segments = []
+        while True:
+            cut = self._boundary()
+            if cut is None:
+                return segments
+            segment, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            if segment:
+                segments.append(segment)
+
+    def flush(self):
+        """Return whatever is buffered as a last segment (may be empty)"""
+        segment, self.buffer = self.buffer.strip(), ""
+        return segment
+
+    def clear(self):
+        self.buffer = ""
@@ -0,0 +1,201 @@
+import collections
+import hashlib
+import io
+import os
+import zipfile
+import zlib
+
+import torch
+import torchaudio
+
+
+def speaker_id_for(gpt_cond_latent, speaker_embedding):
+    """Stable id derived from the (fp16) contents of a speaker's latents"""
+    digest = hashlib.sha256()
+    digest.update(gpt_cond_latent.detach().cpu().half().numpy().tobytes())
+    digest.update(speaker_embedding.detach().cpu().half().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_reference_audio(data, sampling_rate, max_seconds):
+    """Decode an uploaded reference clip in memory: mono, resampled, at most `max_seconds` long.
+
+    Mirrors `TTS.tts.models.xtts.load_audio`, but the clip is cut before it
+    is resampled so long uploads don't cost more than `max_seconds` of audio.
+    """
+    info = torchaudio.info(io.BytesIO(data))
+    audio, sr = torchaudio.load(io.BytesIO(data), num_frames=int(info.sample_rate * max_seconds))
+    if audio.size(0) != 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    if sr != sampling_rate:
+        audio = torchaudio.functional.resample(audio, sr, sampling_rate)
+    audio.clip_(-1, 1)
+    return audio
+
+
+def conditioning_latents(model, audio, sampling_rate, gpt_cond_len, gpt_cond_chunk_len, sound_norm_refs=False):
+    """`Xtts.get_conditioning_latents` for a single clip that is already loaded"""
+    audio = audio.to(model.device)
+    if sound_norm_refs:
+        audio = (audio / torch.abs(audio).max()) * 0.75
+    speaker_embedding = model.get_speaker_embedding(audio, sampling_rate)
+    gpt_cond_latent = model.get_gpt_cond_latents(audio, sampling_rate, length=gpt_cond_len, chunk_length=gpt_cond_chunk_len)
+    return gpt_cond_latent, speaker_embedding
+
+
+def init_clone_worker():
+    """Process pool initializer: one thread per decoding worker"""
+    torch.set_num_threads(1)
+
+
+# What reading a damaged or unsupported zip member can raise
+ARCHIVE_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError)
+
+
+def expand_archive(filename, data, max_files, max_bytes):
+    """Return `[(filename, bytes)]` for an upload, unpacking it if it is a zip archive.
+
+    Archives with more than `max_files` files or more than `max_bytes` of
+    uncompressed data are rejected with ValueError before anything is
+    decompressed (zipfile never reads past a member's declared size). A
+    damaged archive or member comes back as `(filename, exception)` instead
+    of its bytes.
+    """
+    if not zipfile.is_zipfile(io.BytesIO(data)):
+        return [(filename, data)]
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except ARCHIVE_ERRORS as e:
+        return [(filename, e)]
+    with archive:
+        members = []
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            if member.is_dir() or not name or name.startswith(".") or member.filename.startswith("__MACOSX/"):
+                continue
+            if len(members) >= max_files:
+                raise ValueError(f"{filename} contains more than {max_files} files.")
+            members.append(member)
+        if sum(member.file_size for member in members) > max_bytes:
+            raise ValueError(f"{filename} unpacks to more than {max_bytes} bytes.")
+        clips = []
+        for member in members:
+            try:
+                clips.append((member.filename, archive.read(member)))
+            except ARCHIVE_ERRORS as e:
+                clips.append((member.filename, e))
+    return clips
+
+
+def _run_batched(audios, fn, max_batch_size):
+    """Call `fn` on stacks of equal-length clips, falling back to one clip at a time on failure.
+
+    Returns one output (or the exception it raised) per clip.
+    """
+    groups = collections.defaultdict(list)
+    for i, audio in enumerate(audios):
+        groups[audio.shape[-1]].append(i)
+    results = [None] * len(audios)
+    for indices in groups.values():
+        for start in range(0, len(indices), max_batch_size):
+            chunk = indices[start : start + max_batch_size]
+            try:
+                out = fn(torch.cat([audios[i] for i in chunk], dim=0))
+                for j, i in enumerate(chunk):
+                    results[i] = out[j : j + 1]
+            except Exception:
+                for i in chunk:
+                    try:
+                        results[i] = fn(audios[i])
+                    except Exception as e:
+                        results[i] = e
+    return results
+
+
+def batch_conditioning_latents(
+    model, audios, sampling_rate, gpt_cond_len, gpt_cond_chunk_len, sound_norm_refs=False, max_batch_size=16
+):
+    """`conditioning_latents` for many clips, running the encoders on batches.
+
+    Both encoders work on [batch, samples] audio, so clips of the same length
+    (after the cut each encoder applies) are stacked; since uploads are capped
+    to the same maximum length, long clips usually end up in one batch.
+    Returns `(gpt_cond_latent, speaker_embedding)` or an exception per clip.
+    """
+    audios = [audio.to(model.device) for audio in audios]
+    if sound_norm_refs:
+        audios = [(audio / torch.abs(audio).max()) * 0.75 for audio in audios]
+    speaker_embeddings = _run_batched(
+        audios, lambda batch: model.get_speaker_embedding(batch, sampling_rate), max_batch_size
+    )
+    if gpt_cond_len > 0:
+        audios = [audio[:, : sampling_rate * gpt_cond_len] for audio in audios]
+    gpt_cond_latents = _run_batched(
+        audios,
+        lambda batch: model.get_gpt_cond_latents(batch, sampling_rate, length=gpt_cond_len, chunk_length=gpt_cond_chunk_len),
+        max_batch_size,
+    )
+    results = []
+    for gpt_cond_latent, speaker_embedding in zip(gpt_cond_latents, speaker_embeddings):
+        if isinstance(gpt_cond_latent, Exception):
+            results.append(gpt_cond_latent)
+        elif isinstance(speaker_embedding, Exception):
+            results.append(speaker_embedding)
+        else:
+            results.append((gpt_cond_latent, speaker_embedding))
+    return results
+
+
+class SpeakerRegistry:
+    """Conditioning latents kept on the inference device, looked up by id.
+
+    Pinned speakers (the studio speakers) are always available. Everything
+    else is held in a bounded LRU, so clients should re-register a speaker when
+    a lookup fails.
+    """
+
+    def __init__(self, device, max_speakers=256):
+        self.device = device
+        self.max_speakers = max_speakers
+        self.pinned = {}
+        self.speakers = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.pinned) + len(self.speakers)
+
+    def __contains__(self, speaker_id):
+        return speaker_id in self.pinned or speaker_id in self.speakers
+
+    def register(self, gpt_cond_latent, speaker_embedding, speaker_id=None, pinned=False):
+        """Store latents (as shaped for inference) and return their id"""
+        if speaker_id is None:
+            speaker_id = speaker_id_for(gpt_cond_latent, speaker_embedding)
+        self.put(speaker_id, gpt_cond_latent, speaker_embedding, pinned=pinned)
+        return speaker_id
+
+    def put(self, speaker_id, gpt_cond_latent, speaker_embedding, pinned=False):
+        """Store latents under `speaker_id` and return them as shaped for inference.
+
+        The returned tensors stay usable even if the entry is evicted right
+        away (e.g. with `max_speakers=0`).
+        """
+        entry = (
+            gpt_cond_latent.detach().reshape((-1, 1024)).unsqueeze(0).float().to(self.device),
+            speaker_embedding.detach().reshape((1, -1, 1)).float().to(self.device),
+        )
+        if pinned:
+            self.pinned[speaker_id] = entry
+            return entry
+        self.speakers[speaker_id] = entry
+        self.speakers.move_to_end(speaker_id)
+        while len(self.speakers) > self.max_speakers:
+            self.speakers.popitem(last=False)
+        return entry
+
+    def get(self, speaker_id):
+        """Return `(gpt_cond_latent, speaker_embedding)`, raising KeyError if unknown"""
+        if speaker_id in self.pinned:
+            return self.pinned[speaker_id]
+        entry = self.speakers[speaker_id]
+        self.speakers.move_to_end(speaker_id)
+        return entry
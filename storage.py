@@ -0,0 +1,20 @@
+import contextlib
+import os
+import tempfile
+
+
+def write_atomic(path, write):
+    """Write a file through `write(f)` into a temp file next to `path`, then rename it into place.
+
+    Readers never see a partial file, and the temp file is removed if
+    writing fails. Temp files end in `.tmp`.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,143 @@
+"""Compare time-to-first-chunk and real-time factor of eager and COMPILE=1 inference on CPU.
+
+Loads the model in-process (no server), measures `inference_stream` eagerly,
+then compiles and warms up the model like the server does and measures again.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batching import MicroBatchScheduler  # noqa: E402
+from compilation import compile_model  # noqa: E402
+
+TEXTS = [
+    "Hello there.",
+    "It took me quite a long time to develop a voice and now that I have it I am not going to be silent.",
+    "The quick brown fox jumps over the lazy dog. Then it runs back into the forest, and nobody sees it again for a long, long time.",
+]
+SAMPLE_RATE = 24000
+
+
+def load_model(model_path):
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.models.xtts import Xtts
+    from TTS.utils.generic_utils import get_user_data_dir
+    from TTS.utils.manage import ModelManager
+
+    if model_path is None:
+        model_name = "tts_models/multilingual/multi-dataset/xtts_v2"
+        ModelManager().download_model(model_name)
+        model_path = os.path.join(get_user_data_dir("tts"), model_name.replace("/", "--"))
+    config = XttsConfig()
+    config.load_json(os.path.join(model_path, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(config, checkpoint_dir=model_path, eval=True, use_deepspeed=False)
+    return model
+
+
+def measure(model, gpt_cond_latent, speaker_embedding, texts, runs):
+    ttfc, rtf = [], []
+    for _ in range(runs):
+        for text in texts:
+            torch.manual_seed(0)
+            start = time.perf_counter()
+            first, samples = None, 0
+            with torch.inference_mode():
+                for chunk in model.inference_stream(text, "en", gpt_cond_latent, speaker_embedding, enable_text_splitting=True):
+                    if first is None:
+                        first = time.perf_counter() - start
+                    samples += chunk.shape[-1]
+            total = time.perf_counter() - start
+            ttfc.append(first)
+            rtf.append(total / (samples / SAMPLE_RATE))
+    ttfc.sort()
+    rtf.sort()
+    return {
+        "ttfc_p50_s": ttfc[len(ttfc) // 2],
+        "ttfc_max_s": ttfc[-1],
+        "rtf_p50": rtf[len(rtf) // 2],
+        "rtf_max": rtf[-1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_path",
+        default=None,
+        help="Directory with config.json and model.pth (downloads XTTS v2 by default)"
+    )
+    parser.add_argument(
+        "--speaker_file",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_speaker.json"),
+        help="Speaker latents in the /clone_speaker JSON format"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="Timed passes over the text set per mode"
+    )
+    parser.add_argument(
+        "--buckets",
+        default="16,64,160",
+        help="Warm-up text-length buckets (like COMPILE_BUCKETS)"
+    )
+    parser.add_argument(
+        "--mode",
+        default=None,
+        help="torch.compile mode (like COMPILE_MODE)"
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=os.cpu_count(),
+        help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    model = load_model(args.model_path)
+    with open(args.speaker_file, "r") as file:
+        speaker = json.load(file)
+    gpt_cond_latent = torch.tensor(speaker["gpt_cond_latent"]).reshape((-1, 1024)).unsqueeze(0)
+    speaker_embedding = torch.tensor(speaker["speaker_embedding"]).unsqueeze(0).unsqueeze(-1)
+
+    results = {"eager": measure(model, gpt_cond_latent, speaker_embedding, TEXTS, args.runs)}
+
+    start = time.perf_counter()
+    compiled = compile_model(
+        model,
+        MicroBatchScheduler(model, max_batch_size=1),
+        gpt_cond_latent,
+        speaker_embedding,
+        buckets=[int(length) for length in args.buckets.split(",")],
+        mode=args.mode,
+    )
+    if compiled:
+        results["compiled"] = measure(model, gpt_cond_latent, speaker_embedding, TEXTS, args.runs)
+        results["compiled"]["compile_and_warmup_s"] = time.perf_counter() - start
+
+    print(f"{'mode':<10}{'ttfc p50 s':>12}{'ttfc max s':>12}{'rtf p50':>10}{'rtf max':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<10}{result['ttfc_p50_s']:>12.3f}{result['ttfc_max_s']:>12.3f}"
+            f"{result['rtf_p50']:>10.3f}{result['rtf_max']:>10.3f}"
+        )
+    if not compiled:
+        print("torch.compile failed, only eager results are available")
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,122 @@
+"""Compare request payload size and server-side parse time of latent encodings.
+
+Runs without a server or model: it times what the server does with a /tts body
+before synthesis starts (body decode, pydantic validation, tensor build).
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+import msgpack
+import numpy as np
+from pydantic import BaseModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from latents import GptCondLatent, LatentDecoder, SpeakerEmbedding  # noqa: E402
+from speakers import SpeakerRegistry  # noqa: E402
+
+
+class TTSInputs(BaseModel):
+    speaker_embedding: Optional[SpeakerEmbedding] = None
+    gpt_cond_latent: Optional[GptCondLatent] = None
+    text: str
+    language: str
+
+
+def fp16(values):
+    return np.asarray(values, dtype=np.float16).tobytes()
+
+
+def build_bodies(speaker, text):
+    bodies = {}
+    bodies["json"] = ("application/json", json.dumps({"text": text, "language": "en", **speaker}).encode())
+    bodies["json+base64"] = (
+        "application/json",
+        json.dumps(
+            {
+                "text": text,
+                "language": "en",
+                "gpt_cond_latent": base64.b64encode(fp16(speaker["gpt_cond_latent"])).decode("ascii"),
+                "speaker_embedding": base64.b64encode(fp16(speaker["speaker_embedding"])).decode("ascii"),
+            }
+        ).encode(),
+    )
+    bodies["msgpack"] = (
+        "application/msgpack",
+        msgpack.packb(
+            {
+                "text": text,
+                "language": "en",
+                "gpt_cond_latent": fp16(speaker["gpt_cond_latent"]),
+                "speaker_embedding": fp16(speaker["speaker_embedding"]),
+            },
+            use_bin_type=True,
+        ),
+    )
+    return bodies
+
+
+def parse(content_type, body, decoder):
+    data = msgpack.unpackb(body, raw=False) if content_type == "application/msgpack" else json.loads(body)
+    parsed = TTSInputs.parse_obj(data)
+    return decoder.decode(parsed.gpt_cond_latent, parsed.speaker_embedding)
+
+
+def bench(content_type, body, iterations, memoize):
+    times = []
+    for _ in range(iterations):
+        # A fresh registry per call measures the cold decode path
+        decoder = LatentDecoder(SpeakerRegistry("cpu", max_speakers=1))
+        if memoize:
+            parse(content_type, body, decoder)
+        start = time.perf_counter()
+        parse(content_type, body, decoder)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.95)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--speaker_file",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_speaker.json"),
+        help="Speaker latents in the /clone_speaker JSON format"
+    )
+    parser.add_argument(
+        "--text",
+        default="It took me quite a long time to develop a voice and now that I have it I am not going to be silent.",
+        help="text input for the request body"
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=50,
+        help="Number of timed parses per encoding"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    with open(args.speaker_file, "r") as file:
+        speaker = json.load(file)
+
+    results = {}
+    print(f"{'encoding':<14}{'bytes':>10}{'p50 ms':>10}{'p95 ms':>10}{'memo p50 ms':>14}")
+    for name, (content_type, body) in build_bodies(speaker, args.text).items():
+        p50, p95 = bench(content_type, body, args.iterations, memoize=False)
+        memo_p50, _ = bench(content_type, body, args.iterations, memoize=True)
+        results[name] = {"bytes": len(body), "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "memoized_p50_ms": memo_p50 * 1000}
+        print(f"{name:<14}{len(body):>10}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{memo_p50 * 1000:>14.2f}")
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,330 @@
+"""Load test a running server with a mix of /tts and /tts_stream requests.
+
+Requests are sent at a fixed arrival rate (open loop, `--rate`) or by a fixed
+number of clients that send the next request as soon as the last one is done
+(closed loop, `--concurrency`). Each request draws its endpoint, text length
+class, language and speaker from the configured mix. Reports time to first
+chunk, total latency and real-time factor percentiles, throughput in
+audio-seconds per wall-second and error rates.
+"""
+import argparse
+import base64
+import collections
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SAMPLE_RATE = 24000
+WAV_HEADER = 44
+
+TEXTS = {
+    "en": {
+        "short": ["Hello there.", "Thanks for calling, how can I help?"],
+        "medium": [
+            "It took me quite a long time to develop a voice and now that I have it I am not going to be silent.",
+            "The meeting has been moved to Thursday afternoon. Please bring the quarterly numbers with you.",
+        ],
+        "long": [
+            "The quick brown fox jumps over the lazy dog. Then it runs back into the forest, and nobody sees it "
+            "again for a long, long time. Years later, an old farmer claims to have spotted it near the river, "
+            "but by then nobody remembers the story, and the dog has long since stopped waiting at the gate.",
+        ],
+    },
+    "de": {
+        "short": ["Hallo zusammen.", "Vielen Dank für Ihren Anruf."],
+        "medium": ["Das Treffen wurde auf Donnerstagnachmittag verschoben. Bitte bringen Sie die Quartalszahlen mit."],
+        "long": [
+            "Der schnelle braune Fuchs springt über den faulen Hund. Dann läuft er zurück in den Wald, und "
+            "niemand sieht ihn für eine lange, lange Zeit. Jahre später behauptet ein alter Bauer, ihn am Fluss "
+            "gesehen zu haben, aber da erinnert sich niemand mehr an die Geschichte.",
+        ],
+    },
+    "es": {
+        "short": ["Hola a todos.", "Gracias por llamar, ¿en qué puedo ayudarle?"],
+        "medium": ["La reunión se ha cambiado al jueves por la tarde. Por favor, traiga las cifras del trimestre."],
+        "long": [
+            "El rápido zorro marrón salta sobre el perro perezoso. Luego vuelve corriendo al bosque, y nadie lo "
+            "ve durante mucho, mucho tiempo. Años después, un viejo granjero asegura haberlo visto cerca del río, "
+            "pero para entonces nadie recuerda la historia.",
+        ],
+    },
+    "fr": {
+        "short": ["Bonjour à tous.", "Merci de votre appel, comment puis-je vous aider ?"],
+        "medium": ["La réunion a été déplacée à jeudi après-midi. Merci d'apporter les chiffres du trimestre."],
+        "long": [
+            "Le rapide renard brun saute par-dessus le chien paresseux. Puis il retourne dans la forêt, et "
+            "personne ne le revoit pendant très, très longtemps. Des années plus tard, un vieux fermier affirme "
+            "l'avoir aperçu près de la rivière, mais plus personne ne se souvient de l'histoire.",
+        ],
+    },
+}
+
+
+def parse_weights(spec):
+    """Parse "a:3,b:1" (or "a,b" for equal weights) into ([a, b], [3, 1])"""
+    names, weights = [], []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def load_speakers(speaker_files, speaker_ids):
+    """Request fields of every speaker: latents from /clone_speaker JSON files, or studio speaker ids"""
+    speakers = []
+    for path in speaker_files:
+        with open(path, "r") as file:
+            latents = json.load(file)
+        speakers.append({"gpt_cond_latent": latents["gpt_cond_latent"], "speaker_embedding": latents["speaker_embedding"]})
+    speakers.extend({"speaker_id": speaker_id} for speaker_id in speaker_ids)
+    return speakers
+
+
+def make_request(rng, args, texts, speakers):
+    endpoint = rng.choices(*args.endpoints)[0]
+    length = rng.choices(*args.lengths)[0]
+    language = rng.choices(*args.languages)[0]
+    text = rng.choice(texts[language][length])
+    body = {"text": text, "language": language, **rng.choice(speakers)}
+    if endpoint == "tts_stream":
+        body["stream_chunk_size"] = args.stream_chunk_size
+    return {"endpoint": endpoint, "length": length, "language": language, "body": body}
+
+
+def send(session, server_url, request, timeout):
+    """Send one request, return its measurements"""
+    result = {"endpoint": request["endpoint"], "length": request["length"], "language": request["language"]}
+    start = time.perf_counter()
+    try:
+        if request["endpoint"] == "tts_stream":
+            res = session.post(f"{server_url}/tts_stream", json=request["body"], stream=True, timeout=timeout)
+            if res.status_code != 200:
+                result["error"] = str(res.status_code)
+                res.close()
+                return result
+            first, size = None, 0
+            for chunk in res.iter_content(chunk_size=4096):
+                if chunk and first is None:
+                    first = time.perf_counter() - start
+                size += len(chunk)
+            result["ttfc"] = first
+            samples = max(0, size - WAV_HEADER) // 2
+        else:
+            res = session.post(f"{server_url}/tts", json=request["body"], timeout=timeout)
+            if res.status_code != 200:
+                result["error"] = str(res.status_code)
+                return result
+            samples = max(0, len(base64.b64decode(res.json())) - WAV_HEADER) // 2
+    except requests.RequestException as e:
+        result["error"] = type(e).__name__
+        return result
+    result["total"] = time.perf_counter() - start
+    result["ttfc"] = result.get("ttfc") or result["total"]
+    result["audio_seconds"] = samples / SAMPLE_RATE
+    if result["audio_seconds"]:
+        result["rtf"] = result["total"] / result["audio_seconds"]
+    return result
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+
+def summarize(results, wall_seconds):
+    ok = [result for result in results if "error" not in result]
+    errors = collections.Counter(result["error"] for result in results if "error" in result)
+    audio_seconds = sum(result["audio_seconds"] for result in ok)
+    return {
+        "requests": len(results),
+        "errors": dict(errors),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "ttfc_s": percentiles([result["ttfc"] for result in ok]),
+        "total_s": percentiles([result["total"] for result in ok]),
+        "rtf": percentiles([result["rtf"] for result in ok if "rtf" in result]),
+        "audio_seconds": audio_seconds,
+        "throughput_audio_s_per_s": audio_seconds / wall_seconds if wall_seconds else 0.0,
+    }
+
+
+def run(args, texts, speakers):
+    rng = random.Random(args.seed)
+    planned = [make_request(rng, args, texts, speakers) for _ in range(args.requests)]
+    results = []
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one(request):
+        results.append(send(session(), args.server_url, request, args.timeout))
+
+    start = time.perf_counter()
+    if args.rate:
+        # Open loop: arrivals every 1/rate seconds, however slow the server is
+        with ThreadPoolExecutor(max_workers=args.max_clients) as pool:
+            for i, request in enumerate(planned):
+                delay = start + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(one, request)
+    else:
+        requests_iter = iter(planned)
+        lock = threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    request = next(requests_iter, None)
+                if request is None:
+                    return
+                one(request)
+
+        threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    report = {"overall": summarize(results, wall_seconds), "wall_seconds": wall_seconds}
+    key = lambda result: result["endpoint"]  # noqa: E731
+    report["by_endpoint"] = {
+        endpoint: summarize(list(group), wall_seconds)
+        for endpoint, group in itertools.groupby(sorted(results, key=key), key=key)
+    }
+    return report
+
+
+def print_report(report):
+    def fmt(stats, name):
+        return "-" if stats[name] is None else f"{stats[name]['p50']:.2f}/{stats[name]['p95']:.2f}/{stats[name]['p99']:.2f}"
+
+    print(f"{'':<12}{'requests':>9}{'errors':>8}{'ttfc p50/95/99 s':>20}{'total p50/95/99 s':>21}{'rtf p50/95/99':>18}{'audio s/s':>11}")
+    for name, stats in [("overall", report["overall"])] + sorted(report["by_endpoint"].items()):
+        print(
+            f"{name:<12}{stats['requests']:>9}{stats['error_rate']:>8.1%}{fmt(stats, 'ttfc_s'):>20}"
+            f"{fmt(stats, 'total_s'):>21}{fmt(stats, 'rtf'):>18}{stats['throughput_audio_s_per_s']:>11.2f}"
+        )
+    if report["overall"]["errors"]:
+        print("errors:", report["overall"]["errors"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--server_url",
+        default="http://localhost:8000",
+        help="Server url http://localhost:8000 default, change to your server location"
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=50,
+        help="Number of requests to send"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Clients sending requests back to back (closed loop; ignored with --rate)"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Fixed arrival rate in requests per second (open loop)"
+    )
+    parser.add_argument(
+        "--max_clients",
+        type=int,
+        default=256,
+        help="Most requests in flight at once with --rate"
+    )
+    parser.add_argument(
+        "--endpoints",
+        default="tts_stream:1,tts:1",
+        help="Endpoint mix with weights, e.g. 'tts_stream:3,tts:1'"
+    )
+    parser.add_argument(
+        "--lengths",
+        default="short:2,medium:2,long:1",
+        help="Text length mix with weights (short, medium, long)"
+    )
+    parser.add_argument(
+        "--languages",
+        default="en",
+        help="Language mix with weights, e.g. 'en:3,de:1' (en, de, es, fr built in)"
+    )
+    parser.add_argument(
+        "--texts_file",
+        default=None,
+        help="JSON file with texts to use instead, as {language: {length: [texts]}}"
+    )
+    parser.add_argument(
+        "--speaker_files",
+        nargs="*",
+        default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_speaker.json")],
+        help="Speaker latents in the /clone_speaker JSON format (default_speaker.json by default)"
+    )
+    parser.add_argument(
+        "--speaker_ids",
+        nargs="*",
+        default=[],
+        help="Studio or registered speaker ids to mix in"
+    )
+    parser.add_argument(
+        "--stream_chunk_size",
+        default="20",
+        help="stream_chunk_size of /tts_stream requests"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="Per-request timeout in seconds"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the request mix, so runs are comparable"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+    args.endpoints = parse_weights(args.endpoints)
+    args.lengths = parse_weights(args.lengths)
+    args.languages = parse_weights(args.languages)
+
+    texts = TEXTS
+    if args.texts_file:
+        with open(args.texts_file, "r") as file:
+            texts = json.load(file)
+    speakers = load_speakers(args.speaker_files, args.speaker_ids)
+    if not speakers:
+        parser.error("at least one speaker file or speaker id is needed")
+
+    report = run(args, texts, speakers)
+    print_report(report)
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,168 @@
+"""Compare time-to-first-chunk and total latency of multi-sentence requests with and without PIPELINE_DEPTH.
+
+Runs the server's scheduler in-process (no server): each request is split
+into sentences and synthesized one round per sentence, like the inference
+thread does, once with inline vocoding and once with the vocoder on its own
+thread overlapping the GPT decoding of the next chunk or sentence.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backends import StubBackend, XttsBackend  # noqa: E402
+from batching import ScheduledRequest  # noqa: E402
+from bench_compile import load_model  # noqa: E402
+
+TEXTS = [
+    "It took me quite a long time to develop a voice. Now that I have it, I am not going to be silent. "
+    "Speech is power: speech is to persuade, to convert, to compel.",
+    "The quick brown fox jumps over the lazy dog. Then it runs back into the forest. "
+    "Nobody sees it again for a long, long time. Some say it is still out there, waiting.",
+]
+SAMPLE_RATE = 24000
+
+
+class BenchRequest(ScheduledRequest):
+    """One request through the scheduler, timing its first chunk and its end"""
+
+    def __init__(self, backend, text, gpt_cond_latent, speaker_embedding, stream, stream_chunk_size):
+        super().__init__(
+            [backend.tokenize(sentence.strip().lower(), "en") for sentence in reversed(backend.split(text, "en"))],
+            gpt_cond_latent,
+            speaker_embedding,
+            stream=stream,
+            stream_chunk_size=stream_chunk_size,
+        )
+        self.start = time.perf_counter()
+        self.first = None
+        self.total = None
+        self.samples = 0
+
+    def emit(self, wav):
+        if self.first is None:
+            self.first = time.perf_counter() - self.start
+        self.samples += wav.shape[-1]
+
+    def finish(self, error=None):
+        self.total = time.perf_counter() - self.start
+        self.error = error
+
+
+def measure(scheduler, backend, gpt_cond_latent, speaker_embedding, args):
+    ttfc, total, rtf = [], [], []
+    for _ in range(args.runs):
+        for text in TEXTS:
+            torch.manual_seed(0)
+            batch = [BenchRequest(backend, text, gpt_cond_latent, speaker_embedding, args.stream, args.stream_chunk_size)]
+            requests = list(batch)
+            with torch.inference_mode():
+                while batch:
+                    batch = scheduler.run_batch(batch)
+            scheduler.vocoder.wait()
+            for request in requests:
+                if request.error is not None:
+                    raise request.error
+                ttfc.append(request.first)
+                total.append(request.total)
+                rtf.append(request.total / (request.samples / SAMPLE_RATE))
+    ttfc.sort()
+    total.sort()
+    rtf.sort()
+    return {
+        "ttfc_p50_s": ttfc[len(ttfc) // 2],
+        "ttfc_max_s": ttfc[-1],
+        "total_p50_s": total[len(total) // 2],
+        "total_max_s": total[-1],
+        "rtf_p50": rtf[len(rtf) // 2],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_path",
+        default=None,
+        help="Directory with config.json and model.pth (downloads XTTS v2 by default)"
+    )
+    parser.add_argument(
+        "--stub_token_ms",
+        type=float,
+        default=None,
+        help="Use the stub backend with this decode step time instead of XTTS"
+    )
+    parser.add_argument(
+        "--speaker_file",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_speaker.json"),
+        help="Speaker latents in the /clone_speaker JSON format"
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=2,
+        help="PIPELINE_DEPTH to compare against inline vocoding"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream like /tts_stream instead of synthesizing whole sentences like /tts"
+    )
+    parser.add_argument(
+        "--stream_chunk_size",
+        type=int,
+        default=20,
+        help="Audio tokens per streamed chunk"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="Timed passes over the text set per depth"
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=os.cpu_count(),
+        help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    if args.stub_token_ms is not None:
+        backend = StubBackend(token_ms=args.stub_token_ms)
+        gpt_cond_latent, speaker_embedding = backend.studio_speakers()["Stub Speaker"]
+    else:
+        model = load_model(args.model_path)
+        backend = XttsBackend(model, model.config)
+        with open(args.speaker_file, "r") as file:
+            speaker = json.load(file)
+        gpt_cond_latent = torch.tensor(speaker["gpt_cond_latent"]).reshape((-1, 1024)).unsqueeze(0)
+        speaker_embedding = torch.tensor(speaker["speaker_embedding"]).unsqueeze(0).unsqueeze(-1)
+
+    results = {}
+    for depth in (0, args.depth):
+        scheduler = backend.make_scheduler(max_batch_size=1, pipeline_depth=depth)
+        # Untimed pass, so neither depth pays for first-call allocations
+        measure(scheduler, backend, gpt_cond_latent, speaker_embedding, argparse.Namespace(**{**vars(args), "runs": 1}))
+        results[f"depth {depth}"] = measure(scheduler, backend, gpt_cond_latent, speaker_embedding, args)
+
+    print(f"{'pipeline':<10}{'ttfc p50 s':>12}{'ttfc max s':>12}{'total p50 s':>13}{'total max s':>13}{'rtf p50':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<10}{result['ttfc_p50_s']:>12.3f}{result['ttfc_max_s']:>12.3f}"
+            f"{result['total_p50_s']:>13.3f}{result['total_max_s']:>13.3f}{result['rtf_p50']:>10.3f}"
+        )
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
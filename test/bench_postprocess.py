@@ -0,0 +1,102 @@
+"""Compare the per-chunk cost of `postprocess` + `tobytes()` with `PcmWriter`.
+
+Runs without a server or model on random float32 chunks (on the GPU with
+--device cuda). Allocations are counted with tracemalloc, which sees NumPy
+buffers but not torch's own allocations (the `clone()` in `postprocess`).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pcm import PcmWriter, postprocess  # noqa: E402
+
+
+def legacy(wav):
+    return postprocess(wav).tobytes()
+
+
+def bench(convert, chunks, iterations):
+    # Warm up (the writer sizes its buffers on the first chunk)
+    for wav in chunks:
+        convert(wav)
+    times = []
+    for _ in range(iterations):
+        for wav in chunks:
+            start = time.perf_counter()
+            convert(wav)
+            times.append(time.perf_counter() - start)
+    times.sort()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for wav in chunks:
+        convert(wav)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return {
+        "p50_us": times[len(times) // 2] * 1e6,
+        "p95_us": times[int(len(times) * 0.95)] * 1e6,
+        "allocations_per_chunk": allocations / len(chunks),
+        "peak_bytes": peak,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--chunk_samples",
+        type=int,
+        default=24000,
+        help="Samples per chunk (24000 is one second of audio)"
+    )
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        default=20,
+        help="Chunks per stream"
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=20,
+        help="Number of timed passes over the stream"
+    )
+    parser.add_argument(
+        "--device",
+        default="cpu",
+        help="Device the chunks start on (cpu or cuda)"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    chunks = [torch.rand(args.chunk_samples, device=args.device) * 2.4 - 1.2 for _ in range(args.chunks)]
+    writer = PcmWriter()
+    assert all(bytes(writer.write(wav)) == legacy(wav) for wav in chunks), "PcmWriter output differs from postprocess"
+
+    results = {
+        "postprocess": bench(legacy, chunks, args.iterations),
+        "PcmWriter": bench(writer.write, chunks, args.iterations),
+    }
+    print(f"{'path':<14}{'p50 us':>10}{'p95 us':>10}{'allocs/chunk':>14}{'peak bytes':>12}")
+    for name, result in results.items():
+        print(
+            f"{name:<14}{result['p50_us']:>10.1f}{result['p95_us']:>10.1f}"
+            f"{result['allocations_per_chunk']:>14.1f}{result['peak_bytes']:>12}"
+        )
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
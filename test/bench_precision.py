@@ -0,0 +1,119 @@
+"""Measure speed-up and quality loss of the reduced-precision CPU modes against fp32.
+
+Loads the model in-process (no server). Every configuration synthesizes the
+same texts with greedy decoding, so differences come from precision rather
+than sampling. Quality is the log-spectral distance (dB) to the fp32 audio
+over the frames both outputs have; the length ratio shows where decoding
+diverged.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_compile import TEXTS, load_model  # noqa: E402
+from precision import apply_precision  # noqa: E402
+
+CONFIGS = [("fp32", "fp32"), ("int8", "fp32"), ("bf16", "fp32"), ("fp32", "bf16"), ("int8", "bf16"), ("bf16", "bf16")]
+
+
+def log_spectral_distance(reference, wav, n_fft=1024, hop_length=256):
+    """Mean per-frame log-spectral distance in dB over the common length"""
+    length = min(len(reference), len(wav))
+    window = torch.hann_window(n_fft)
+    spectra = [
+        torch.stft(x[:length], n_fft, hop_length=hop_length, window=window, return_complex=True).abs().clamp_min(1e-5)
+        for x in (reference, wav)
+    ]
+    diff = 20 * torch.log10(spectra[0] / spectra[1])
+    return diff.pow(2).mean(dim=0).sqrt().mean().item()
+
+
+def synthesize(model, gpt_cond_latent, speaker_embedding, texts, runs):
+    wavs, times = [], []
+    for text in texts:
+        best = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            with torch.inference_mode():
+                out = model.inference(text, "en", gpt_cond_latent, speaker_embedding, do_sample=False)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        wavs.append(torch.as_tensor(out["wav"]).float().reshape(-1))
+        times.append(best)
+    return wavs, times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_path",
+        default=None,
+        help="Directory with config.json and model.pth (downloads XTTS v2 by default)"
+    )
+    parser.add_argument(
+        "--speaker_file",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_speaker.json"),
+        help="Speaker latents in the /clone_speaker JSON format"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=2,
+        help="Timed runs per text (the fastest counts)"
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=os.cpu_count(),
+        help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--output_json",
+        default=None,
+        help="Also write the results as JSON to this file"
+    )
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    base = load_model(args.model_path)
+    with open(args.speaker_file, "r") as file:
+        speaker = json.load(file)
+    gpt_cond_latent = torch.tensor(speaker["gpt_cond_latent"]).reshape((-1, 1024)).unsqueeze(0)
+    speaker_embedding = torch.tensor(speaker["speaker_embedding"]).unsqueeze(0).unsqueeze(-1)
+
+    results = {}
+    reference, reference_times = None, None
+    print(f"{'gpt/vocoder':<14}{'time s':>10}{'speed-up':>10}{'LSD dB':>10}{'len ratio':>11}")
+    for gpt_precision, vocoder_precision in CONFIGS:
+        model = base if (gpt_precision, vocoder_precision) == ("fp32", "fp32") else copy.deepcopy(base)
+        applied = apply_precision(model, gpt_precision, vocoder_precision)
+        name = "/".join(applied)
+        if name in results:
+            continue
+        wavs, times = synthesize(model, gpt_cond_latent, speaker_embedding, TEXTS, args.runs)
+        if reference is None:
+            reference, reference_times = wavs, times
+        result = {
+            "seconds": sum(times),
+            "speed_up": sum(reference_times) / sum(times),
+            "lsd_db": sum(log_spectral_distance(r, w) for r, w in zip(reference, wavs)) / len(wavs),
+            "length_ratio": sum(len(w) for w in wavs) / sum(len(r) for r in reference),
+        }
+        results[name] = result
+        print(
+            f"{name:<14}{result['seconds']:>10.2f}{result['speed_up']:>10.2f}"
+            f"{result['lsd_db']:>10.2f}{result['length_ratio']:>11.3f}"
+        )
+        if model is not base:
+            del model
+
+    if args.output_json:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,23 @@
+"""Streaming resampling of output profiles (runs without a server or model)."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from audio_formats import PolyphaseResampler  # noqa: E402
+
+
+@pytest.mark.parametrize("rate_out", [8000, 16000])
+def test_resampler_compensates_group_delay(rate_out):
+    n = 24000 + 123
+    x = (0.5 * np.sin(2 * np.pi * 440 * np.arange(n) / 24000)).astype(np.float32)
+    resampler = PolyphaseResampler(24000, rate_out)
+    y = np.concatenate([resampler.process(x[i : i + 700]) for i in range(0, n, 700)] + [resampler.flush()])
+
+    assert len(y) == -(-n * rate_out // 24000)
+    # In phase with the input from the first sample on (edges aside, where the filter sees silence)
+    expected = 0.5 * np.sin(2 * np.pi * 440 * np.arange(len(y)) / rate_out)
+    assert np.abs(y - expected)[200:-200].max() < 1e-3
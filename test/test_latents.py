@@ -0,0 +1,43 @@
+"""Decoding of inline conditioning latents (runs without a server or model)."""
+import base64
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from latents import LatentDecoder  # noqa: E402
+from speakers import SpeakerRegistry  # noqa: E402
+
+
+def fp16_base64(values):
+    return base64.b64encode(np.asarray(values, dtype=np.float16).tobytes()).decode("ascii")
+
+
+@pytest.fixture
+def decoder():
+    return LatentDecoder(SpeakerRegistry("cpu"))
+
+
+def test_decode_shapes(decoder):
+    gpt_cond_latent, speaker_embedding = decoder.decode(fp16_base64(np.zeros(32 * 1024)), fp16_base64(np.zeros(512)))
+    assert gpt_cond_latent.shape == (1, 32, 1024)
+    assert speaker_embedding.shape == (1, 512, 1)
+
+
+def test_decode_without_a_cache():
+    decoder = LatentDecoder(SpeakerRegistry("cpu", max_speakers=0))
+    gpt_cond_latent, speaker_embedding = decoder.decode(fp16_base64(np.zeros(32 * 1024)), fp16_base64(np.zeros(512)))
+    assert gpt_cond_latent.shape == (1, 32, 1024)
+    assert speaker_embedding.shape == (1, 512, 1)
+
+
+@pytest.mark.parametrize("encode", [lambda values: values.tolist(), fp16_base64], ids=["json", "base64"])
+def test_wrong_size_latents_raise_value_error(decoder, encode):
+    speaker_embedding = encode(np.zeros(512))
+    with pytest.raises(ValueError, match="gpt_cond_latent"):
+        decoder.decode(encode(np.zeros((3, 1000))), speaker_embedding)
+    with pytest.raises(ValueError, match="speaker_embedding"):
+        decoder.decode(encode(np.zeros((32, 1024))), encode(np.zeros(500)))
@@ -0,0 +1,166 @@
+"""Scheduling of synthesis requests, run in-process against a small fake XTTS (no weights, no server)."""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backends import StubBackend  # noqa: E402
+from batching import MicroBatchScheduler, ScheduledRequest, SynthesisRequest  # noqa: E402
+from executor import InferenceExecutor  # noqa: E402
+
+DIM = 8
+STEPS = 20
+
+
+class FakeDecoder(torch.nn.Module):
+    """`GPT2InferenceModel` stand-in: every decode step reads the stored prefix, like the real one"""
+
+    def __init__(self, stop_audio_token):
+        super().__init__()
+        self.stop_audio_token = stop_audio_token
+        self.lm_head = torch.nn.Linear(DIM, DIM)
+
+    def store_prefix_emb(self, prefix_emb):
+        self.cached_prefix_emb = prefix_emb
+
+    def _steps(self, inputs):
+        for step in range(STEPS):
+            # Long enough for a concurrent batch to store its prefix in between
+            time.sleep(0.002)
+            prefix = self.cached_prefix_emb
+            assert prefix.shape[0] == inputs.shape[0], "decoding against another batch's prefix"
+            yield (prefix.sum(dim=(1, 2)) * 1000).round().long() % 500 + step
+        yield torch.full((inputs.shape[0],), self.stop_audio_token)
+
+    def generate(self, inputs, attention_mask, max_length, **kwargs):
+        assert "do_stream" not in kwargs
+        return torch.cat([inputs, torch.stack(list(self._steps(inputs)), dim=1)], dim=1)
+
+    def generate_stream(self, inputs, attention_mask, max_length, do_stream=False, **kwargs):
+        """Yields `(tokens, hidden states)` per step, like `NewGenerationMixin.generate(do_stream=True)`"""
+        assert do_stream
+        for tokens in self._steps(inputs):
+            yield tokens, tokens.float()[:, None].repeat(1, DIM)
+
+
+class FakeGpt:
+    start_text_token = 254
+    stop_text_token = 255
+    start_audio_token = 1024
+    stop_audio_token = 1025
+    max_gen_mel_tokens = 600
+    code_stride_len = 1024
+
+    def __init__(self):
+        self.text_embedding = torch.nn.Embedding(256, DIM)
+        self.text_pos_embedding = lambda tokens: torch.zeros(tokens.shape[-1], DIM)
+        self.gpt_inference = FakeDecoder(self.stop_audio_token)
+
+    def __call__(self, tokens, text_len, codes, expected_output_len, cond_latents, **kwargs):
+        return codes.float()[..., None]
+
+
+class FakeXtts:
+    device = torch.device("cpu")
+
+    def __init__(self):
+        torch.manual_seed(0)
+        self.gpt = FakeGpt()
+
+    def hifigan_decoder(self, latents, g):
+        return latents.flatten() * g.sum()
+
+    def handle_chunks(self, wav_gen, wav_gen_prev, wav_overlap, overlap_len):
+        """The new part of the wav (the real one also cross-fades the chunk edges)"""
+        wav_chunk = wav_gen if wav_gen_prev is None else wav_gen[len(wav_gen_prev) :]
+        return wav_chunk, wav_gen, None
+
+    def inference(self, temperature=0.75, length_penalty=1.0, repetition_penalty=10.0, top_k=50, top_p=0.85, do_sample=True, num_beams=1):
+        pass
+
+    def inference_stream(self, temperature=0.75, length_penalty=1.0, repetition_penalty=10.0, top_k=50, top_p=0.85, do_sample=True, overlap_wav_len=1024):
+        pass
+
+
+class Request(ScheduledRequest):
+    def __init__(self, text, speaker, stream=False):
+        super().__init__(
+            [torch.IntTensor(list(text.encode("utf-8"))).unsqueeze(0)],
+            torch.full((1, 4, DIM), float(speaker)),
+            torch.ones((1, 4, 1)),
+            stream=stream,
+            stream_chunk_size=8,
+        )
+        self.wavs = []
+
+    def emit(self, wav):
+        self.wavs.append(wav)
+
+
+BATCHES = [[("the first lane", 0.1), ("speaks two voices", 0.2)], [("the second lane has one", 0.3)]]
+
+
+def synthesize(scheduler, batches, lanes, stream=False):
+    requests = [[Request(text, speaker, stream) for text, speaker in batch] for batch in batches]
+    with ThreadPoolExecutor(max_workers=lanes) as pool:
+        list(pool.map(scheduler.run_batch, requests))
+    for request in sum(requests, []):
+        assert request.error is None
+    return [[torch.cat(request.wavs) for request in batch] for batch in requests]
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["batch", "stream"])
+def test_lanes_decode_with_their_own_prefix(stream):
+    scheduler = MicroBatchScheduler(FakeXtts())
+    expected = synthesize(scheduler, BATCHES, lanes=1, stream=stream)
+    for _ in range(3):
+        outputs = synthesize(scheduler, BATCHES, lanes=2, stream=stream)
+        for wavs, expected_wavs in zip(outputs, expected):
+            for wav, expected_wav in zip(wavs, expected_wavs):
+                assert torch.equal(wav, expected_wav)
+
+
+LONG_TEXT = " ".join(f"This is sentence number {i} of a rather long request." for i in range(15))
+
+
+def test_late_short_request_does_not_wait_for_long_ones():
+    """With every batch slot held by multi-sentence requests, a newcomer still gets picked at the next round"""
+
+    async def run():
+        backend = StubBackend(token_ms=1)
+        executor = InferenceExecutor(backend, backend.make_scheduler(max_batch_size=2, max_wait_ms=10))
+        executor.start()
+        latents = backend.studio_speakers()["Stub Speaker"]
+        start = time.monotonic()
+
+        async def speak(text, delay=0):
+            await asyncio.sleep(delay)
+            request = await executor.submit(SynthesisRequest(text, "en", *latents, stream=True))
+            await request.result()
+            return time.monotonic() - start
+
+        try:
+            long_1, long_2, short = await asyncio.gather(speak(LONG_TEXT), speak(LONG_TEXT), speak("Hi.", delay=0.3))
+        finally:
+            await executor.stop()
+        assert short < 0.3 + (min(long_1, long_2) - 0.3) / 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "text, language",
+    [("Съешь же ещё этих мягких французских булок, да выпей чаю. " * 8, "ru"), ("我能吞下玻璃而不伤身体。" * 40, "zh-cn")],
+)
+def test_stub_accepts_what_xtts_accepts(text, language):
+    backend = StubBackend()
+    sentences = backend.split(text, language)
+    for sentence in sentences:
+        tokens = backend.tokenize(sentence, language)
+        assert tokens.shape[-1] <= backend.char_limits[language.split("-")[0]]
@@ -0,0 +1,36 @@
+"""Unpacking of /clone_speakers uploads (runs without a server or model)."""
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from speakers import expand_archive  # noqa: E402
+
+
+def make_zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_archive_over_the_size_limit_is_rejected():
+    # 64 MiB of zeros deflate to a few dozen KiB
+    data = make_zip({"a.wav": bytes(32 << 20), "b.wav": bytes(32 << 20)})
+    with pytest.raises(ValueError, match="unpacks to more than"):
+        expand_archive("bomb.zip", data, max_files=10, max_bytes=48 << 20)
+
+
+def test_damaged_member_is_a_per_file_error():
+    data = bytearray(make_zip({"good.wav": b"RIFF" + bytes(1000), "bad.wav": b"RIFF" + bytes(range(256)) * 4}))
+    # Flip a byte of the second member's compressed data
+    offset = data.index(b"bad.wav") + len("bad.wav") + 10
+    data[offset] ^= 0xFF
+    clips = dict(expand_archive("clips.zip", bytes(data), max_files=10, max_bytes=1 << 20))
+    assert clips["good.wav"] == b"RIFF" + bytes(1000)
+    assert isinstance(clips["bad.wav"], Exception)
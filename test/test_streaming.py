@@ -38,11 +38,12 @@ def stream_ffplay(audio_stream, output_file, save=True):
     ffplay_proc.wait()
 
 
-def tts(text, speaker, language, server_url, stream_chunk_size) -> Iterator[bytes]:
+def tts(text, speaker, language, server_url, stream_chunk_size, output_format="wav") -> Iterator[bytes]:
     start = time.perf_counter()
     speaker["text"] = text
     speaker["language"] = language
     speaker["stream_chunk_size"] = stream_chunk_size  # you can reduce it to get faster response, but degrade quality
+    speaker["output_format"] = output_format
     res = requests.post(
         f"{server_url}/tts_stream",
         json=speaker,
@@ -105,6 +106,12 @@ if __name__ == "__main__":
         default="20",
         help="Stream chunk size , 20 default, reducing will get faster latency but may degrade quality"
     )
+    parser.add_argument(
+        "--output_format",
+        default="wav",
+        choices=["wav", "opus", "mp3", "flac"],
+        help="Audio format to stream, wav (raw PCM) default, opus for low bandwidth"
+    )
     args = parser.parse_args()
 
     with open("./default_speaker.json", "r") as file:
@@ -120,7 +127,8 @@ if __name__ == "__main__":
             speaker,
             args.language,
             args.server_url,
-            args.stream_chunk_size
+            args.stream_chunk_size,
+            args.output_format
         ), 
         args.output_file,
         save=bool(args.output_file)